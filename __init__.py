@@ -30,6 +30,14 @@ __url__ = 'https://launchpad.net/ubuntu-bots/'
 
 import config
 reload(config)
+import transport
+reload(transport)
+import cveindex
+reload(cveindex)
+import metrics
+reload(metrics)
+import soap
+reload(soap) # After metrics, it registers its own
 import plugin
 reload(plugin)
 
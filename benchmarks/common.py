@@ -0,0 +1,41 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Helpers shared by the benchmarks. They need supybot to be importable, but not
+a running bot.
+"""
+
+import os, sys, time
+
+plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_plugin():
+    """Import the plugin module the same way __init__.py does"""
+    if plugin_dir not in sys.path:
+        sys.path.insert(0, plugin_dir)
+    import config
+    import plugin
+    return plugin
+
+def timeit(func, seconds=2.0):
+    """Call func() repeatedly for about <seconds>, returns (calls, elapsed)"""
+    calls = 0
+    start = time.time()
+    end = start + seconds
+    while time.time() < end:
+        func()
+        calls += 1
+    return (calls, time.time() - start)
@@ -0,0 +1,81 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Benchmark of every driver's get_bug against the local stand-in server (see
+server.py), so it runs without network access. Each driver is run once with
+the server answering right away, which shows the cost of fetching and parsing,
+and once with simulated network latency.
+
+Usage: python benchmarks/drivers.py [seconds per driver] [latency in ms]
+"""
+
+import sys, time
+from common import load_plugin
+import server
+
+def drivers(plugin, url):
+    """[(name, tracker, bug id)] of all drivers, pointed at the stand-in server"""
+    launchpad = plugin.Launchpad('launchpad', 'https://launchpad.net', 'Launchpad')
+    launchpad.api_root = url + '/launchpad/1.0'
+    return [
+        ('bugzilla', plugin.Bugzilla('bugzilla', url + '/bugzilla', 'Bugzilla'), 1),
+        ('bugzilla (huge bug)', plugin.Bugzilla('bugzilla', url + '/bugzilla', 'Bugzilla'), 2),
+        ('trac', plugin.Trac('trac', url + '/trac/ticket', 'Trac'), 1),
+        ('wikiforms', plugin.WikiForms('wikiforms', url + '/wikiforms/Bugs', 'WikiForms'), 1),
+        ('str', plugin.Str('str', url + '/str/str.php', 'STR'), 1),
+        ('launchpad', launchpad, 1),
+        ('debbugs', plugin.Debbugs('debbugs', url + '/debbugs', 'Debbugs'), 1),
+        ('mantis', plugin.Mantis('mantis', url + '/mantis', 'Mantis'), 1),
+    ]
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def run(tracker, id, seconds):
+    """Call get_bug for about <seconds>, returns the latency of every call"""
+    latencies = []
+    end = time.time() + seconds
+    while time.time() < end:
+        started = time.time()
+        tracker.get_bug(id)
+        latencies.append(time.time() - started)
+    return latencies
+
+def main(seconds=2.0, latency=0.05):
+    plugin = load_plugin()
+    for (title, delay) in (("local", 0.0), ("%dms latency" % (latency * 1000), latency)):
+        stand_in = server.start(delay)
+        print "%s:" % title
+        print "  %-20s %10s %10s %10s %9s" % ('driver', 'bugs/s', 'p50 ms', 'p95 ms', 'requests')
+        for (name, tracker, id) in drivers(plugin, stand_in.url):
+            try:
+                tracker.get_bug(id) # Warm up and check it works at all
+            except Exception, e:
+                print "  %-20s skipped: %s" % (name, e)
+                continue
+            stand_in.requests = 0
+            latencies = run(tracker, id, seconds)
+            print "  %-20s %10.1f %10.2f %10.2f %9d" % (name, len(latencies) / sum(latencies),
+                    percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, stand_in.requests)
+        plugin.transport.pool.clear() # Close the kept-alive connections
+        stand_in.shutdown()
+        stand_in.server_close()
+
+if __name__ == '__main__':
+    seconds = len(sys.argv) > 1 and float(sys.argv[1]) or 2.0
+    latency = len(sys.argv) > 2 and float(sys.argv[2]) / 1000 or 0.05
+    main(seconds, latency)
@@ -0,0 +1,172 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Local stand-in for the bugtrackers, serving the recorded responses in
+fixtures/ so the drivers can be benchmarked on a box without network access.
+
+Every tracker type lives under its own path, point a tracker's url at it:
+  /bugzilla   show_bug.cgi?id=N&ctype=xml, several id= give several bugs.
+              Bug 2 is huge: a few thousand comments and attachments.
+  /trac       ticket/N?format=tab, query?id=N|M|...&format=tab for several
+  /wikiforms  Bugs/N
+  /str        str.php?LN
+  /launchpad  the web service, at /launchpad/1.0 (set the tracker's api_root)
+  /debbugs    cgi-bin/soap.cgi, SOAP get_status for any number of bugs
+  /mantis     api/soap/mantisconnect.php, SOAP mc_issue_get
+Bug 404 is not found on all of them.
+
+Usage: python benchmarks/server.py [port] [latency in ms]
+"""
+
+import os, re, sys, time, socket, threading, BaseHTTPServer, SocketServer
+
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def fixture(name):
+    fd = open(os.path.join(fixture_dir, name), 'rb')
+    try:
+        return fd.read()
+    finally:
+        fd.close()
+
+def repeat_bugs(template, ids, missing=''):
+    """Repeat the part of template between <!-- bug --> and <!-- /bug --> for
+    every id, filling in @ID@. Bug 404 gets <missing> instead"""
+    start = template.index('<!-- bug -->')
+    end = template.index('<!-- /bug -->') + len('<!-- /bug -->')
+    bug = template[start:end]
+    bugs = [(id == 404 and [missing] or [bug.replace('@ID@', str(id))])[0] for id in ids]
+    return template[:start] + ''.join(bugs) + template[end:]
+
+def huge_bugzilla(template, comments=3000):
+    """A bug with <comments> comments and as many attachments, all of which
+    come after the fields the plugin reports on"""
+    comment = template[template.index('<long_desc'):template.index('</long_desc>') + len('</long_desc>')]
+    attachment = template[template.index('<attachment'):template.index('</attachment>') + len('</attachment>')]
+    pos = template.index('</bug>')
+    return template[:pos] + (comment + attachment) * comments + template[pos:]
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one go, or delayed ACKs add 40ms to every request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body='', content_type='text/plain'):
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def fill(self, data, id):
+        return data.replace('@ID@', str(id)).replace('@BASE@', self.server.url).replace('@API@', self.server.url + '/launchpad/1.0')
+
+    def do_GET(self):
+        self.server.requests += 1
+        path = self.path
+        m = re.match(r'/bugzilla/show_bug\.cgi\?(.*)$', path)
+        if m:
+            ids = [int(id) for id in re.findall(r'(?:^|&)id=(\d+)', m.group(1))]
+            template = self.server.fixtures['bugzilla.xml']
+            if ids == [2]:
+                body = self.fill(self.server.huge_bugzilla, 2)
+            else:
+                body = repeat_bugs(template, ids, '<bug error="NotFound"><bug_id>404</bug_id></bug>')
+                body = self.fill(body, 0)
+            return self.respond(200, body, 'text/xml; charset=UTF-8')
+        m = re.match(r'/trac/ticket/(\d+)\?format=tab$', path)
+        if m:
+            return self.by_id(int(m.group(1)), 'trac.tab', 'text/tab-separated-values; charset=utf-8', 500)
+        m = re.match(r'/trac/query\?(?:.*&)?id=([\d|]+)(?:&.*)?$', path)
+        if m:
+            (header, row) = self.server.fixtures['trac.tab'].split('\n', 1)
+            rows = [self.fill(row, id) for id in map(int, m.group(1).split('|')) if id != 404]
+            return self.respond(200, header + '\n' + ''.join(rows), 'text/tab-separated-values; charset=utf-8')
+        m = re.match(r'/wikiforms/Bugs/(\d+)$', path)
+        if m:
+            return self.by_id(int(m.group(1)), 'wikiforms.html', 'text/html; charset=utf-8')
+        m = re.match(r'/str/str\.php\?L(\d+)$', path)
+        if m:
+            return self.by_id(int(m.group(1)), 'str.html', 'text/html; charset=utf-8')
+        m = re.match(r'/launchpad/1\.0/bugs/(\d+)(/bug_tasks)?(?:\?.*)?$', path)
+        if m:
+            return self.by_id(int(m.group(1)), m.group(2) and 'launchpad-tasks.json' or 'launchpad-bug.json', 'application/json')
+        if re.match(r'/launchpad/1\.0/~[\w.+-]+$', path):
+            return self.by_id(0, 'launchpad-person.json', 'application/json')
+        self.respond(404, 'Not found')
+
+    def by_id(self, id, name, content_type, missing=404):
+        if id == 404:
+            return self.respond(missing, 'Not found')
+        self.respond(200, self.fill(self.server.fixtures[name], id), content_type)
+
+    def do_POST(self):
+        self.server.requests += 1
+        request = self.rfile.read(int(self.headers.get('content-length', 0)))
+        ids = [int(id) for id in re.findall(r'>\s*(\d+)\s*<', request)]
+        if self.path == '/debbugs/cgi-bin/soap.cgi':
+            body = repeat_bugs(self.server.fixtures['debbugs.xml'], ids)
+            return self.respond(200, body, 'text/xml; charset=utf-8')
+        if self.path == '/mantis/api/soap/mantisconnect.php':
+            id = ids and ids[-1] or 0
+            if id == 404:
+                body = fault % "Issue #404 not found."
+                return self.respond(500, body, 'text/xml; charset=utf-8')
+            return self.respond(200, self.fill(self.server.fixtures['mantis.xml'], id), 'text/xml; charset=utf-8')
+        self.respond(404, 'Not found')
+
+fault = '''<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"><SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode><faultstring>%s</faultstring></SOAP-ENV:Fault></SOAP-ENV:Body></SOAP-ENV:Envelope>'''
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency  = latency # Seconds to wait before every response
+        self.url      = 'http://127.0.0.1:%d' % self.server_port
+        self.requests = 0
+        self.fixtures = dict([(name, fixture(name)) for name in os.listdir(fixture_dir)])
+        self.huge_bugzilla = huge_bugzilla(self.fixtures['bugzilla.xml'])
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], socket.error): # Clients closing kept-alive connections
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+def start(latency=0.0, port=0):
+    """Run a stand-in server in a background thread and return it"""
+    server = StandIn(port, latency)
+    thread = threading.Thread(target=server.serve_forever, name='Bugtracker stand-in server')
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+if __name__ == '__main__':
+    port = len(sys.argv) > 1 and int(sys.argv[1]) or 8000
+    latency = len(sys.argv) > 2 and float(sys.argv[2]) / 1000 or 0.0
+    server = StandIn(port, latency)
+    print "Serving the fixtures on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,87 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Microbenchmark for matching the snarfer regexps against channel messages.
+
+Compares running the four snarfer regexps one after the other (with the old
+bugSnarfer pattern) against the prefilter and single combined scan the plugin
+uses now. Usage: python benchmarks/snarfers.py [seconds]
+"""
+
+import re, sys
+from common import load_plugin, timeit
+
+# bugSnarfer's pattern before the lookahead was changed to not backtrack
+old_bug_re = r"""\b(?P<bt>(([a-z0-9]+)?\s+bugs?|[a-z0-9]+)):?\s+#?(?P<bug>\d+(?!\d*[\-\.]\d+)((,|\s*(and|en|et|und|ir))\s*#?\d+(?!\d*[\-\.]\d+))*)"""
+
+lines = [
+    "hi all, anyone around?",
+    "I upgraded and now my wifi doesn't work anymore :(",
+    "have you tried turning it off and on again",
+    "see bug 123456 for the details",
+    "that's launchpad bug 654321, fixed in the -proposed kernel",
+    "bugs 1, 3 and 89 are all dupes",
+    "https://bugs.launchpad.net/ubuntu/+source/linux/+bug/1234567",
+    "http://bugzilla.gnome.org/show_bug.cgi?id=598123 is the upstream one",
+    "this is CVE-2011-0997, the dhclient one",
+    "got OOPS-1234ABC when loading the page",
+    "uname -r says 2.6.38-8-generic",
+    "my IP is 192.168.1.10 and the gateway is 192.168.1.1",
+    "[ 1234.567890] usb 2-1.2: new high speed USB device using ehci_hcd and address 3",
+    "apt-get install foo=1.2.3-4ubuntu5 bar=2.0.1-1",
+    "The following packages have unmet dependencies: libc6 (>= 2.13-0ubuntu13)",
+    "ok thanks, that fixed it",
+    "1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28 29 30",
+    "00000000000000000000000000000000000000000000000000000000000000000000000000000000.1",
+    "does anyone know why nautilus is so slow on nfs mounts",
+    "lol",
+]
+
+def separate(res):
+    """The old way: every snarfer regexp runs over every message"""
+    def run():
+        for line in lines:
+            for r in res:
+                for m in r.finditer(line):
+                    pass
+    return run
+
+def combined(scanner, prefilter):
+    def run():
+        for line in lines:
+            if not prefilter.search(line):
+                continue
+            for m in scanner.finditer(line):
+                pass
+    return run
+
+def main():
+    seconds = len(sys.argv) > 1 and float(sys.argv[1]) or 2.0
+    plugin = load_plugin()
+    klass = plugin.Bugtracker
+    flags = klass.flags
+    docs = [(getattr(klass, name).__doc__, name) for name in klass.regexps]
+    old = [re.compile(name == 'bugSnarfer' and old_bug_re or doc, flags) for (doc, name) in docs]
+    new = [(re.compile(doc, flags), name) for (doc, name) in docs]
+    scanner = plugin.combine_regexps(new, flags)
+
+    for (label, func) in (("four regexps", separate(old)),
+                          ("prefilter + single scan", combined(scanner, plugin.snarf_prefilter))):
+        (calls, elapsed) = timeit(func, seconds)
+        print "%-25s %10.0f messages/s" % (label, calls * len(lines) / elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -112,11 +112,116 @@ conf.registerGlobalValue(Bugtracker, 'replyWhenNotFound',
 conf.registerChannelValue(Bugtracker, 'repeatdelay',
     registry.Integer(60, """Number of seconds to wait between repeated bug calls"""))
 
+conf.registerGlobalValue(Bugtracker, 'repeatMaxEntries',
+    registry.PositiveInteger(10000, """Maximum number of recently shown bugs to
+    remember for repeat protection"""))
+
 conf.registerChannelValue(Bugtracker, 'showassignee',
     registry.Boolean(False, """Whether to show the assignee in bug reports"""))
 
 conf.registerChannelValue(Bugtracker, 'extended',
     registry.Boolean(False, "Show optional extneded bug information, specific to trackers"))
+
+conf.registerGlobalValue(Bugtracker, 'lookupThreads',
+    registry.PositiveInteger(4, """Number of threads that do all bugtracker
+    lookups. Messages are not handled in threads of their own, so this is the
+    most lookups that can be in progress at the same time"""))
+
+conf.registerGlobalValue(Bugtracker, 'maxPendingLookups',
+    registry.NonNegativeInteger(500, """Maximum number of lookups waiting for a
+    free thread, lookups beyond that are refused. 0 means no limit"""))
+
+conf.registerGlobalValue(Bugtracker, 'trackerConcurrency',
+    registry.PositiveInteger(2, """Maximum number of lookups to run against a single
+    bugtracker at the same time"""))
+
+conf.registerGlobalValue(Bugtracker, 'cveIndex',
+    registry.String('Bugtracker-cve.idx', """File in the data directory for the
+    local CVE index, see the cveimport command. CVEs which are not in the index
+    are looked up on cve.mitre.org"""))
+
+conf.registerGlobalValue(Bugtracker, 'duplicateFile',
+    registry.String('Bugtracker-duplicates.json', """File in the data directory
+    to keep the Launchpad duplicates in, so looking up a duplicate fetches its
+    master bug right away"""))
+
+conf.registerGlobalValue(Bugtracker, 'duplicateTTL',
+    registry.NonNegativeInteger(3600, """Number of seconds to remember which bug
+    a Launchpad duplicate is a duplicate of. Until then the duplicate itself
+    isn't fetched, so if it is marked as a duplicate of another bug, no longer
+    a duplicate or made private, it is reported as before for up to this long.
+    Longer saves more requests for popular duplicates, 0 disables this"""))
+
+conf.registerGlobalValue(Bugtracker, 'httpTimeout',
+    registry.PositiveInteger(10, """Number of seconds to wait for a bugtracker's
+    web server before giving up. Once a bugtracker's latency is known its
+    timeout is derived from that, this is then the upper limit"""))
+
+conf.registerGlobalValue(Bugtracker, 'httpMinTimeout',
+    registry.PositiveInteger(2, """Lower limit for the timeout derived from a
+    bugtracker's latency"""))
+
+conf.registerGlobalValue(Bugtracker, 'circuitFailures',
+    registry.PositiveInteger(5, """Number of failed requests in a row after which
+    a bugtracker is considered down and lookups on it fail immediately"""))
+
+conf.registerGlobalValue(Bugtracker, 'circuitCooldown',
+    registry.PositiveInteger(60, """Number of seconds to wait before trying a
+    bugtracker again that is considered down"""))
+
+conf.registerGlobalValue(Bugtracker, 'pageMaxBytes',
+    registry.NonNegativeInteger(1048576, """Maximum number of bytes to read of an
+    HTML bug page (WikiForms, STR and Sourceforge trackers) before giving up on
+    it. 0 means no limit"""))
+
+conf.registerGlobalValue(Bugtracker, 'pageMaxTime',
+    registry.NonNegativeInteger(10, """Maximum number of seconds to spend
+    reading an HTML bug page before giving up on it. 0 means no limit"""))
+
+conf.registerGlobalValue(Bugtracker, 'httpMaxIdle',
+    registry.NonNegativeInteger(4, """Number of idle keep-alive connections to
+    keep open per host"""))
+
+conf.registerGlobalValue(Bugtracker, 'httpCacheSize',
+    registry.NonNegativeInteger(500, """Number of downloaded pages to keep, so
+    they can be revalidated with If-None-Match/If-Modified-Since instead of
+    downloaded again. The whole bodies of the pages are kept in memory, see
+    httpCacheMaxBytes"""))
+
+conf.registerGlobalValue(Bugtracker, 'httpCacheMaxBytes',
+    registry.NonNegativeInteger(8388608, """Maximum total size in bytes of the
+    page bodies kept for revalidation, least recently used pages are dropped
+    first. 0 means no limit other than httpCacheSize"""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheSize',
+    registry.NonNegativeInteger(1000, """Maximum number of bug reports to keep in
+    the report cache"""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheMaxBytes',
+    registry.NonNegativeInteger(1048576, """Approximate maximum number of bytes the
+    report cache may use, least recently used reports are dropped first"""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheTTL',
+    registry.NonNegativeInteger(300, """Number of seconds to cache bug reports for
+    bugtrackers which don't set their own time"""))
+
+conf.registerGlobalValue(Bugtracker, 'staleWhileRevalidate',
+    registry.NonNegativeInteger(0, """Number of seconds after a cached bug report
+    expires that it may still be used for a reply. The report is then fetched
+    again in the background, so the next reply is up to date. 0 disables this."""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheNegativeTTL',
+    registry.NonNegativeInteger(60, """Number of seconds to remember that a bug
+    could not be found or is private"""))
+
+conf.registerGlobalValue(Bugtracker, 'metricsFile',
+    registry.String('', """File to periodically write the lookup metrics to, in
+    the Prometheus text format. Relative to the data directory, empty to not
+    write them"""))
+
+conf.registerGlobalValue(Bugtracker, 'metricsInterval',
+    registry.PositiveInteger(60, """Number of seconds between writes of the
+    metrics file"""))
     
 #conf.registerGlobalValue(Bugtracker, 'reportercache',
 #    registry.String('', """Name of the basedir for the bugreporter cache""", private=True))
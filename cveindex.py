@@ -0,0 +1,269 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Local CVE id -> description index, loaded from the bulk CVE exports.
+
+The index is one file that gets mmap'ed: a header, a table of fixed-size
+records sorted by CVE id and the UTF-8 descriptions the records point to.
+Looking up an id is a binary search over the table, nothing is parsed or read
+into memory up front. Importing another dump (e.g. the "modified" feed) merges
+it into the existing index and replaces the file atomically.
+
+Understood dump formats, optionally gzipped:
+ * CSV, as in MITRE's allitems.csv (Name, Status, Description, ...)
+ * NVD JSON feeds ({"CVE_Items": [...]})
+ * CVE JSON 5 records, a single record or a list of them
+"""
+
+import os, re, csv, gzip, json, mmap, struct, threading
+
+magic = 'BTCVE001'
+header = struct.Struct('<8sI4x')   # magic, number of records
+record = struct.Struct('<QII')     # key, offset and length of the description
+
+cvere = re.compile(r'^CVE-(\d{4})-(\d{4,})$', re.I)
+def cve_key(cve):
+    """Turns 'CVE-2011-0997' into a sortable integer, None if it's no CVE id"""
+    m = cvere.match(cve.strip())
+    if not m:
+        return None
+    return (int(m.group(1)) << 32) | int(m.group(2))
+
+class CVEIndex:
+    def __init__(self, path):
+        self.path  = path
+        self.fd    = None
+        self.mm    = None
+        self.count = 0
+        self.lock  = threading.Lock() # Held by lookups and while the file is replaced
+        self.update_lock = threading.Lock()
+        self.open()
+
+    def open(self):
+        self.close()
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        fd = open(self.path, 'rb')
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        (m, count) = header.unpack_from(mm, 0)
+        if m != magic:
+            mm.close()
+            fd.close()
+            raise ValueError, "%s is not a CVE index" % self.path
+        (self.fd, self.mm, self.count) = (fd, mm, count)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.fd.close()
+        (self.fd, self.mm, self.count) = (None, None, 0)
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return record.unpack_from(self.mm, header.size + i * record.size)
+
+    def _description(self, offset, length):
+        start = header.size + self.count * record.size + offset
+        return self.mm[start:start + length].decode('utf-8')
+
+    def lookup(self, cve):
+        """Returns the description of <cve>, or None if it's not in the index"""
+        key = cve_key(cve)
+        if key is None:
+            return None
+        self.lock.acquire()
+        try:
+            (lo, hi) = (0, self.count)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                (k, offset, length) = self._record(mid)
+                if k < key:
+                    lo = mid + 1
+                elif k > key:
+                    hi = mid
+                else:
+                    return self._description(offset, length)
+            return None
+        finally:
+            self.lock.release()
+
+    def _existing(self):
+        """All (key, description) in the index, in order"""
+        for i in xrange(self.count):
+            (k, offset, length) = self._record(i)
+            yield (k, self._description(offset, length))
+
+    def update(self, entries):
+        """Merge (cve id, description) pairs into the index, newer descriptions
+        replace older ones. Returns the number of entries read. The merged
+        index is written next to the old one while lookups go on, they only
+        wait while the new file is swapped in"""
+        new = {}
+        for (cve, description) in entries:
+            key = cve_key(cve)
+            if key is not None and description:
+                new[key] = u' '.join(description.split())
+        # Only one update at a time, the mmap is only replaced by updates so
+        # it can be read without self.lock
+        self.update_lock.acquire()
+        try:
+            keys = []
+            tmp = self.path + '.new'
+            data = open(tmp + '.data', 'w+b')
+            try:
+                # Merge the sorted existing index with the sorted new entries
+                pending = sorted(new.items())
+                (i, offset) = (0, 0)
+                def write(key, description):
+                    blob = description.encode('utf-8')
+                    data.write(blob)
+                    keys.append(record.pack(key, offset, len(blob)))
+                    return offset + len(blob)
+                for (key, description) in self._existing():
+                    while i < len(pending) and pending[i][0] < key:
+                        offset = write(*pending[i])
+                        i += 1
+                    if i < len(pending) and pending[i][0] == key:
+                        offset = write(*pending[i])
+                        i += 1
+                    else:
+                        offset = write(key, description)
+                for (key, description) in pending[i:]:
+                    offset = write(key, description)
+
+                out = open(tmp, 'wb')
+                try:
+                    out.write(header.pack(magic, len(keys)))
+                    out.write(''.join(keys))
+                    data.seek(0)
+                    while True:
+                        chunk = data.read(65536)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                finally:
+                    out.close()
+            finally:
+                data.close()
+                os.remove(tmp + '.data')
+            self.lock.acquire()
+            try:
+                self.close()
+                os.rename(tmp, self.path)
+                self.open()
+            finally:
+                self.lock.release()
+        finally:
+            self.update_lock.release()
+        return len(new)
+
+def _open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+def _english(descriptions):
+    for d in descriptions or []:
+        if d.get('lang', 'en').startswith('en') and d.get('value'):
+            return d['value']
+    return None
+
+def _nvd_entry(item):
+    cve = item.get('cve', {})
+    return (cve.get('CVE_data_meta', {}).get('ID', ''),
+            _english(cve.get('description', {}).get('description_data')))
+
+def _json_entries(data):
+    if isinstance(data, dict) and 'CVE_Items' in data: # NVD feed
+        for item in data['CVE_Items']:
+            yield _nvd_entry(item)
+    elif isinstance(data, dict) and 'cveMetadata' in data: # CVE JSON 5
+        cna = data.get('containers', {}).get('cna', {})
+        yield (data['cveMetadata'].get('cveId', ''), _english(cna.get('descriptions')))
+    elif isinstance(data, dict) and 'cveRecords' in data:
+        for r in data['cveRecords']:
+            for entry in _json_entries(r):
+                yield entry
+    elif isinstance(data, list):
+        for r in data:
+            for entry in _json_entries(r):
+                yield entry
+
+chunksize = 65536
+arrayre = re.compile(r'"(CVE_Items|cveRecords)"\s*:\s*\[')
+
+def _array_items(fd, buf):
+    """Yield the values of a JSON array one by one. buf holds what was read
+    of the array after its '[', the rest is read from fd a chunk at a time,
+    so only one value is in memory at once"""
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buf):
+            (buf, pos) = (fd.read(chunksize), 0)
+            if not buf:
+                raise ValueError, "Unterminated JSON array"
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            (value, end) = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # Most likely the value isn't read completely yet
+            more = fd.read(chunksize)
+            if not more:
+                raise
+            (buf, pos) = (buf[pos:] + more, 0)
+            continue
+        yield value
+        pos = end
+
+def read_dump(path):
+    """Yield (cve id, description) from a bulk CVE export. The records of NVD
+    feeds and lists of CVE JSON 5 records are parsed one at a time, a full
+    feed is never loaded at once"""
+    fd = _open_dump(path)
+    try:
+        start = fd.read(chunksize).lstrip()
+        if start.startswith('['):
+            for r in _array_items(fd, start[1:]):
+                for entry in _json_entries(r):
+                    yield entry
+            return
+        if start.startswith('{'):
+            m = arrayre.search(start)
+            if m is None: # A single record
+                for entry in _json_entries(json.loads(start + fd.read())):
+                    yield entry
+            elif m.group(1) == 'CVE_Items':
+                for item in _array_items(fd, start[m.end():]):
+                    yield _nvd_entry(item)
+            else:
+                for r in _array_items(fd, start[m.end():]):
+                    for entry in _json_entries(r):
+                        yield entry
+            return
+        fd.close()
+        fd = _open_dump(path)
+        for row in csv.reader(fd):
+            if len(row) >= 3 and row[0].startswith('CVE-'):
+                yield (row[0], row[2].decode('utf-8', 'replace'))
+    finally:
+        fd.close()
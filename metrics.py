@@ -0,0 +1,189 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Counters and latency histograms of the plugin, kept in memory and written out
+in the Prometheus text format so the node exporter's textfile collector (or
+anything else that reads that format) can pick them up.
+
+Metrics are identified by a name and a set of labels, e.g.
+stats.observe('bugtracker_stage_seconds', 0.2, stage='fetch', tracker='launchpad').
+Names ending in _total are counters, names with observations are histograms
+and everything else is a gauge.
+"""
+
+import os, time, threading, bisect
+
+# Upper bounds of the histogram buckets, in seconds. Regex matching takes
+# microseconds, a slow tracker tens of seconds.
+buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1) # The last one is +Inf
+        self.sum    = 0.0
+        self.count  = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-quantile falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return i < len(buckets) and buckets[i] or float('inf')
+        return float('inf')
+
+class Timer:
+    """with stats.timer('name', label=value): ... observes how long the block took"""
+    def __init__(self, metrics, name, labels):
+        (self.metrics, self.name, self.labels) = (metrics, name, labels)
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.time() - self.started, **self.labels)
+        return False
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                              for (k, v) in labels])
+
+def _format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
+
+class Metrics:
+    def __init__(self):
+        self.values     = {} # (name, labels) -> number, for counters and gauges
+        self.histograms = {} # (name, labels) -> Histogram
+        self.help       = {} # name -> description
+        self.lock       = threading.Lock()
+
+    def describe(self, name, description):
+        self.help[name] = description
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labels(labels))
+        self.lock.acquire()
+        try:
+            self.values[key] = self.values.get(key, 0) + amount
+        finally:
+            self.lock.release()
+
+    def set(self, name, value, **labels):
+        """Set a gauge, or a counter kept somewhere else"""
+        self.lock.acquire()
+        try:
+            self.values[(name, _labels(labels))] = value
+        finally:
+            self.lock.release()
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        self.lock.acquire()
+        try:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+        finally:
+            self.lock.release()
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def get(self, name, **labels):
+        return self.values.get((name, _labels(labels)), 0)
+
+    def select(self, name):
+        """[(labels dict, value or Histogram)] of all series of a metric"""
+        self.lock.acquire()
+        try:
+            series = [(dict(l), v) for ((n, l), v) in self.values.items() if n == name]
+            series += [(dict(l), h) for ((n, l), h) in self.histograms.items() if n == name]
+        finally:
+            self.lock.release()
+        series.sort(key=lambda s: sorted(s[0].items()))
+        return series
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        self.lock.acquire()
+        try:
+            values = sorted(self.values.items())
+            histograms = sorted([(k, (list(h.counts), h.sum, h.count)) for (k, h) in self.histograms.items()])
+        finally:
+            self.lock.release()
+        lines = []
+        last = None
+        for ((name, labels), value) in values:
+            if name != last:
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s %s' % (name, name.endswith('_total') and 'counter' or 'gauge'))
+                last = name
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        for ((name, labels), (counts, total, count)) in histograms:
+            if name != last:
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s histogram' % name)
+                last = name
+            cumulative = 0
+            for (bound, n) in zip(list(buckets) + [float('inf')], counts):
+                cumulative += n
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', _format_value(bound))]), cumulative))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels), repr(total)))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to path, atomically so a reader never sees half a file"""
+        tmp = path + '.tmp'
+        fd = open(tmp, 'w')
+        try:
+            fd.write(self.prometheus())
+        finally:
+            fd.close()
+        os.rename(tmp, path)
+
+# The metrics of the plugin, see Bugtracker.update_metrics for the ones copied
+# in from the cache and the HTTP transport
+stats = Metrics()
+stats.describe('bugtracker_stage_seconds', 'Time spent per stage of a lookup')
+stats.describe('bugtracker_lookups_total', 'Bugs looked up, including cached ones')
+stats.describe('bugtracker_errors_total', 'Failed lookups by exception type')
+stats.describe('bugtracker_http_received_bytes_total', 'Bytes received from a host, before decompression')
+stats.describe('bugtracker_cache_lookups_total', 'Report cache lookups by result')
+stats.describe('bugtracker_circuit_open', '1 while a tracker is considered down')
+stats.describe('bugtracker_launchpad_requests_total', 'Launchpad web service requests made by bug lookups')
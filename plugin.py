@@ -14,6 +14,9 @@
 #
 ###
 
+import time
+import_started = time.time()
+
 from supybot.commands import *
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
@@ -25,21 +28,36 @@ import supybot.schedule as schedule
 import supybot.log as supylog
 
 #import imaplib
-import re, os, time, commands
-import xml.dom.minidom as minidom
-from htmlentitydefs import entitydefs as entities
-import email.FeedParser
-import SOAPpy
+import re, os, commands, threading, heapq, math, httplib, traceback
+import json, csv, codecs
+from cStringIO import StringIO
+from collections import OrderedDict, deque
+import xml.parsers.expat as expat
+from htmlentitydefs import name2codepoint
+import transport
+import soap
+import cveindex
+import metrics
+from metrics import stats
+# email.FeedParser and launchpadlib are slow to import, they are only
+# imported when a tracker that needs them is first used.
 
 # All the words below will be censored when reporting bug information
 bad_words = set(["fuck","fuk","fucking","fuking","fukin","fuckin","fucked","fuked","fucker","shit","cunt","bastard","nazi","nigger","nigga","cock","bitches","bitch"])
 
+# Only whole words between whitespace are censored, never parts of a URL
+bad_words_re = re.compile(r'(?<!\S)(?:%s)(?!\S)' % '|'.join(sorted(bad_words, key=len, reverse=True)), re.I)
+
 def makeClean(s):
-    words = s.split()
-    for word in words:
-        if word.lower() in bad_words:
-            words[words.index(word)] = "<censored>"
-    return " ".join(words)
+    return bad_words_re.sub("<censored>", " ".join(s.split()))
+
+# Reply templates, by (extended, has product)
+report_templates = {
+    (True,  True):  '%(tracker)sbug %(id)s in %(product)s "%(title)s" %(extinfo)s [%(severity)s,%(status)s] %(url)s',
+    (False, True):  '%(tracker)sbug %(id)s in %(product)s "%(title)s" [%(severity)s,%(status)s] %(url)s',
+    (True,  False): '%(tracker)sbug %(id)s "%(title)s" %(extinfo)s [%(severity)s,%(status)s] %(url)s',
+    (False, False): '%(tracker)sbug %(id)s "%(title)s" [%(severity)s,%(status)s] %(url)s',
+}
 
 def registerBugtracker(name, url='', description='', trackertype=''):
     conf.supybot.plugins.Bugtracker.bugtrackers().add(name)
@@ -47,6 +65,8 @@ def registerBugtracker(name, url='', description='', trackertype=''):
     URL         = conf.registerGlobalValue(group, 'url', registry.String(url, ''))
     DESC        = conf.registerGlobalValue(group, 'description', registry.String(description, ''))
     TRACKERTYPE = conf.registerGlobalValue(group, 'trackertype', registry.String(trackertype, ''))
+    conf.registerGlobalValue(group, 'cachettl', registry.NonNegativeInteger(0, """Number of seconds
+    to cache reports from this bugtracker, 0 uses the default for its type"""))
     if url:
         URL.setValue(url)
     if description:
@@ -57,29 +77,23 @@ def registerBugtracker(name, url='', description='', trackertype=''):
         else:
             raise BugtrackerError("Unknown trackertype: %s" % trackertype)
             
-entre = re.compile('&(\S*?);')
-def _getnodetxt(node):
-    L = []
-    for childnode in node.childNodes:
-        if childnode.nodeType == childnode.TEXT_NODE:
-            L.append(childnode.data)
-    if not L:
-        raise ValueError, "No text nodes"
-    val = ''.join(L)
-    if node.hasAttribute('encoding'):
-        encoding = node.getAttribute('encoding')
-        if encoding == 'base64':
-            try:
-                val = val.decode('base64')
-            except:
-                val = 'Cannot convert bug data from base64.'
-    while entre.search(val):
-        entity = entre.search(val).group(1)
-        if entity in entities:
-            val = entre.sub(entities[entity], val)
-        else:
-            val = entre.sub('?', val)
-    return val
+entre = re.compile('&(#?\w+?);')
+def _entity(match):
+    entity = match.group(1)
+    try:
+        if entity.startswith('#x'):
+            return unichr(int(entity[2:], 16))
+        if entity.startswith('#'):
+            return unichr(int(entity[1:]))
+        return unichr(name2codepoint[entity])
+    except (KeyError, ValueError):
+        return u'?'
+
+def _decode_entities(val):
+    """Decode HTML entities left in (already XML-decoded) text, in one pass"""
+    if '&' not in val:
+        return val
+    return entre.sub(_entity, val)
 
 class BugtrackerError(Exception):
     """A bugtracker error"""
@@ -89,26 +103,576 @@ class BugNotFoundError(Exception):
     """Pity, bug isn't there"""
     pass
 
+class BugCache:
+    """Bounded LRU cache of tracker results, keyed by (tracker url, bug id).
+    BugNotFoundError and errors about private bugs are cached as well, but
+    only for negative_ttl seconds. With a stale window, reports that expired
+    less than stale seconds ago are still returned, and refreshed in the
+    background."""
+    def __init__(self, maxsize=1000, maxbytes=1048576, ttl=300, negative_ttl=60, stale=0):
+        self.maxsize      = maxsize
+        self.maxbytes     = maxbytes
+        self.ttl          = ttl
+        self.negative_ttl = negative_ttl
+        self.stale        = stale
+        self.entries      = OrderedDict() # (url, id) -> (expires, size, reports, error)
+        self.refreshing   = set()         # (url, id) being refreshed in the background
+        self.inflight     = {}            # (url, id) being fetched -> [waiter]
+        self.bytes        = 0
+        self.hits = self.misses = self.negative_hits = self.stale_hits = self.evictions = self.coalesced = 0
+        self.lock         = threading.Lock()
+
+    @staticmethod
+    def _size(reports):
+        size = 64
+        for r in reports:
+            for field in r:
+                if isinstance(field, basestring):
+                    size += len(field)
+                else:
+                    size += 8
+        return size
+
+    @staticmethod
+    def cacheable_error(e):
+        return isinstance(e, BugNotFoundError) or (isinstance(e, BugtrackerError) and 'private' in str(e))
+
+    def lookup(self, tracker, id):
+        """Returns (found, reports, error, stale) for a cached entry"""
+        key = (tracker.url, id)
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return (False, None, None, False)
+            stale = entry[0] < now
+            if stale and (entry[3] is not None or entry[0] + self.stale < now):
+                self.bytes -= entry[1]
+                self.misses += 1
+                return (False, None, None, False)
+            self.entries[key] = entry # Move to the most recently used end
+            if entry[3] is not None:
+                self.negative_hits += 1
+            elif stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return (True, entry[2], entry[3], stale)
+        finally:
+            self.lock.release()
+
+    def store(self, tracker, id, reports=None, error=None):
+        key = (tracker.url, id)
+        if error is not None:
+            expires = time.time() + self.negative_ttl
+            size = 64 + len(str(error))
+        else:
+            expires = time.time() + (getattr(tracker, 'cache_ttl', 0) or self.ttl)
+            size = self._size(reports)
+        self.lock.acquire()
+        try:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (expires, size, reports, error)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.maxsize or self.bytes > self.maxbytes):
+                (k, old) = self.entries.popitem(last=False)
+                self.bytes -= old[1]
+                self.evictions += 1
+        finally:
+            self.lock.release()
+
+    def refresh(self, tracker, id, fetch, background):
+        """Fetch bug <id> again with background(key, fetch, args, callback),
+        unless that's already being done"""
+        key = (tracker.url, id)
+        self.lock.acquire()
+        try:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        finally:
+            self.lock.release()
+        def done(outcome):
+            (ok, result) = outcome
+            self.lock.acquire()
+            try:
+                self.refreshing.discard(key)
+            finally:
+                self.lock.release()
+            if ok:
+                self.store(tracker, id, result)
+            elif self.cacheable_error(result):
+                self.store(tracker, id, error=result)
+        try:
+            background(tracker.url, fetch, (id,), done)
+        except Exception:
+            done((False, None))
+
+    def lookup_many(self, tracker, ids, fetch=None, background=None):
+        """Returns ({id: (ok, reports-or-exception)}, [ids that aren't cached]).
+        Stale reports are refreshed with fetch and background, see refresh"""
+        results = {}
+        misses = []
+        for id in ids:
+            (found, reports, error, stale) = self.lookup(tracker, id)
+            if not found:
+                misses.append(id)
+            elif error is not None:
+                results[id] = (False, error)
+            else:
+                if stale and background is not None:
+                    self.refresh(tracker, id, fetch, background)
+                results[id] = (True, reports)
+        return (results, misses)
+
+    def claim(self, tracker, ids, waiter):
+        """Returns the ids of ids that nobody is fetching yet. The caller
+        must fetch those and pass the outcome to fill. For the others,
+        waiter(id, reports-or-exception) is called when the fetch that is in
+        progress is filled in, so each bug is only fetched once at a time"""
+        own = []
+        self.lock.acquire()
+        try:
+            for id in ids:
+                key = (tracker.url, id)
+                if key in self.inflight:
+                    self.inflight[key].append(waiter)
+                    self.coalesced += 1
+                else:
+                    self.inflight[key] = []
+                    own.append(id)
+        finally:
+            self.lock.release()
+        return own
+
+    def fill(self, tracker, ids, fetched):
+        """Cache what was fetched for claimed ids ({id: reports-or-exception})
+        and pass it on to whoever is waiting for it. Returns fetched, with
+        missing ids filled in as BugNotFoundError"""
+        waiting = []
+        for id in ids:
+            result = fetched.get(id)
+            if result is None:
+                result = fetched[id] = BugNotFoundError()
+            if isinstance(result, Exception):
+                if self.cacheable_error(result):
+                    self.store(tracker, id, error=result)
+            else:
+                self.store(tracker, id, result)
+            self.lock.acquire()
+            try:
+                waiting.extend([(waiter, id, result) for waiter in self.inflight.pop((tracker.url, id), [])])
+            finally:
+                self.lock.release()
+        for (waiter, id, result) in waiting:
+            waiter(id, result)
+        return fetched
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.bytes = 0
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        hits = self.hits + self.negative_hits + self.stale_hits
+        lookups = hits + self.misses
+        ratio = lookups and 100.0 * hits / lookups or 0.0
+        return "%d entries (%d bytes), %d hits, %d negative hits, %d stale hits, %d misses (%.1f%% hit rate), %d evictions, %d lookups joined one in progress" % (
+                len(self.entries), self.bytes, self.hits, self.negative_hits, self.stale_hits, self.misses, ratio, self.evictions, self.coalesced)
+
+class RepeatGuard:
+    """Remembers what was shown where until its repeat delay runs out. Entries
+    are kept in a heap ordered by expiry, so expired entries are dropped in
+    amortized O(log n) without scanning everything, and never more than
+    maxsize entries are kept (the ones closest to expiring go first)."""
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.expires = {} # key -> expiry time
+        self.heap    = [] # [(expiry time, key)]
+        self.lock    = threading.Lock()
+
+    def _expire(self, now):
+        heap = self.heap
+        while heap and (heap[0][0] <= now or len(self.expires) > self.maxsize):
+            (expires, key) = heapq.heappop(heap)
+            if self.expires.get(key) == expires:
+                del self.expires[key]
+
+    def check(self, key, delay):
+        """Returns True and remembers key for delay seconds if it wasn't seen
+        recently, False otherwise"""
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self._expire(now)
+            if key in self.expires:
+                return False
+            if delay > 0:
+                self.expires[key] = now + delay
+                heapq.heappush(self.heap, (now + delay, key))
+                self._expire(now)
+            return True
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.expires)
+
+class TrackerIndex:
+    """Maps the host of a bug URL to the tracker living there. Trackers that
+    share a host are told apart by the longest matching path prefix, and
+    subdomains fall back to their parent domain (bugs.launchpad.net ->
+    launchpad.net), so a lookup costs the same however many trackers there are."""
+    def __init__(self):
+        self.hosts = {} # host -> [(path prefix, name, tracker)], longest prefix first
+        self.names = {} # name -> host
+
+    @staticmethod
+    def split(url):
+        url = url.replace('http://','').replace('https://','')
+        if '/' in url:
+            (host, path) = url.split('/', 1)
+            return (host.lower(), '/' + path)
+        return (url.lower(), '/')
+
+    def add(self, name, tracker):
+        self.remove(name)
+        if 'sourceforge.net' in tracker.url:
+            # sourceforge.net has no API or structured bug exporting, HTML
+            # scraping is not good enough. Especially as SF keep changing it
+            return
+        (host, path) = self.split(tracker.url)
+        host = host.split(':')[0]
+        entries = self.hosts.setdefault(host, [])
+        entries.append((path.rstrip('/') + '/', name, tracker))
+        entries.sort(key=lambda entry: -len(entry[0])) # Stable, so the first added wins ties
+        self.names[name.lower()] = host
+
+    def remove(self, name):
+        host = self.names.pop(name.lower(), None)
+        if host is None:
+            return
+        entries = [entry for entry in self.hosts[host] if entry[1].lower() != name.lower()]
+        if entries:
+            self.hosts[host] = entries
+        else:
+            del self.hosts[host]
+
+    def lookup(self, url):
+        (host, path) = self.split(url)
+        host = host.split(':')[0]
+        while host:
+            entries = self.hosts.get(host)
+            if entries:
+                for (prefix, name, tracker) in entries:
+                    if path.startswith(prefix) or path + '/' == prefix:
+                        return tracker
+                return entries[-1][2] # Same host, but none of the paths match
+            if '.' not in host:
+                break
+            host = host.split('.', 1)[1]
+        return None
+
+def log_error(msg, e):
+    """Log an unexpected exception that a FetchPool job raised, with its
+    original traceback"""
+    supylog.error("%s\n%s" % (msg, getattr(e, 'traceback', None) or repr(e)))
+
+class FetchPool:
+    """A fixed set of worker threads to run lookups on. Jobs are queued per
+    key (the tracker url) and at most per_key jobs for the same key run at
+    the same time, so one slow tracker can't take all the workers. At most
+    maxpending jobs wait in the queue, 0 means no limit."""
+    def __init__(self, workers=4, per_key=2, maxpending=0):
+        self.workers = workers
+        self.per_key = per_key
+        self.maxpending = maxpending
+        self.cond    = threading.Condition()
+        self.pending = [] # [(key, func, args, callback)], oldest first
+        self.running = {} # key -> number of running jobs
+        self.threads = []
+        self.stopped = False
+
+    def _next_job(self):
+        for (i, job) in enumerate(self.pending):
+            if self.running.get(job[0], 0) < self.per_key:
+                del self.pending[i]
+                self.running[job[0]] = self.running.get(job[0], 0) + 1
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            self.cond.acquire()
+            try:
+                job = self._next_job()
+                while job is None and not self.stopped:
+                    self.cond.wait()
+                    job = self._next_job()
+                if self.stopped:
+                    return
+            finally:
+                self.cond.release()
+            (key, func, args, callback) = job
+            try:
+                result = (True, func(*args))
+            except Exception, e:
+                # The callback may run later and elsewhere, keep the traceback for log_error
+                e.traceback = traceback.format_exc()
+                result = (False, e)
+            self.cond.acquire()
+            try:
+                self.running[key] -= 1
+                if not self.running[key]:
+                    del self.running[key]
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+            try:
+                callback(result)
+            except Exception:
+                supylog.exception("Bugtracker: Error in lookup callback")
+
+    def _submit(self, jobs):
+        """Queue all jobs, or none of them if there is no room"""
+        self.cond.acquire()
+        try:
+            if self.stopped:
+                raise BugtrackerError, "The lookup pool has been stopped"
+            if self.maxpending and len(self.pending) + len(jobs) > self.maxpending:
+                raise BugtrackerError, "Too many lookups in progress, try again later"
+            self.pending.extend(jobs)
+            for i in range(min(len(jobs), self.workers - len(self.threads))):
+                t = threading.Thread(target=self._work, name="Bugtracker lookup %d" % len(self.threads))
+                t.setDaemon(True)
+                self.threads.append(t)
+                t.start()
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def submit(self, key, func, args, callback):
+        """Run func(*args) on a worker and pass (ok, result-or-exception) to callback"""
+        self._submit([(key, func, args, callback)])
+
+    def map_async(self, key, func, items, callback):
+        """Run func(item) for every item concurrently, callback gets the list
+        of (ok, result-or-exception) in the order of items"""
+        results = [None] * len(items)
+        remaining = [len(items)]
+        lock = threading.Lock()
+        def done(i, result):
+            lock.acquire()
+            try:
+                results[i] = result
+                remaining[0] -= 1
+                finished = not remaining[0]
+            finally:
+                lock.release()
+            if finished:
+                callback(results)
+        if not items:
+            callback(results)
+        self._submit([(key, func, (item,), lambda result, i=i: done(i, result)) for (i, item) in enumerate(items)])
+
+    def stop(self):
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.pending = []
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+class TrackerHealth:
+    """Recent latency and failures of one bugtracker, with a circuit breaker:
+    after `threshold` failed requests in a row the circuit opens and lookups
+    fail immediately for `cooldown` seconds. Then a single lookup is let
+    through to probe the tracker (half-open), the outcome of its requests
+    closes the circuit again or keeps it open for another cooldown. Request
+    timeouts follow the latency of recent successful requests."""
+    threshold   = 5    # Failures in a row that open the circuit
+    cooldown    = 60   # Seconds to fail fast before probing
+    min_timeout = 2
+    max_timeout = 10   # Also used until enough latencies are known
+    window      = 50   # Number of recent requests to look at
+    min_samples = 10   # Latencies needed before the timeout is adapted
+    percentile  = 0.95
+    factor      = 3    # Timeout is this many times the latency percentile
+
+    def __init__(self):
+        self.latencies = deque(maxlen=self.window) # Of successful requests
+        self.outcomes  = deque(maxlen=self.window) # True for a failure
+        self.failures  = 0    # Failures in a row
+        self.opened    = None # When the circuit opened, None while closed
+        self.probing   = None # When the half-open probe was let through
+        self.lock      = threading.Lock()
+
+    @classmethod
+    def configure(cls, **kwargs):
+        for (k, v) in kwargs.items():
+            setattr(cls, k, v)
+
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if self.probing is not None or self.opened + self.cooldown <= time.time():
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Returns 0 if a lookup may go ahead, else the number of seconds
+        until the tracker will be tried again"""
+        now = time.time()
+        self.lock.acquire()
+        try:
+            if self.opened is None:
+                return 0
+            retry = self.opened + self.cooldown
+            if self.probing is not None:
+                # Don't wait forever on a probe that never reported back
+                retry = max(retry, self.probing + 2 * self.max_timeout)
+            if retry > now:
+                return int(math.ceil(retry - now))
+            self.probing = now
+            return 0
+        finally:
+            self.lock.release()
+
+    def record(self, latency, ok):
+        """Record the outcome of a request. Returns True if this failure
+        opened the circuit"""
+        self.lock.acquire()
+        try:
+            self.outcomes.append(not ok)
+            if ok:
+                self.latencies.append(latency)
+                (self.failures, self.opened, self.probing) = (0, None, None)
+                return False
+            self.failures += 1
+            if self.probing is not None or (self.opened is None and self.failures >= self.threshold):
+                (self.opened, self.probing) = (time.time(), None)
+                return True
+            return False
+        finally:
+            self.lock.release()
+
+    def latency(self, percentile):
+        """Latency percentile of recent successful requests, None if there
+        are too few of them"""
+        samples = sorted(self.latencies)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def timeout(self):
+        latency = self.latency(self.percentile)
+        if latency is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, latency * self.factor))
+
+    def error_rate(self):
+        outcomes = list(self.outcomes)
+        return outcomes and float(outcomes.count(True)) / len(outcomes) or 0.0
+
+health_lock = threading.Lock()
+tracker_health = {} # url -> TrackerHealth, shared by trackers with the same url
+def get_health(url):
+    health_lock.acquire()
+    try:
+        if url not in tracker_health:
+            tracker_health[url] = TrackerHealth()
+        return tracker_health[url]
+    finally:
+        health_lock.release()
+
+def is_outage(e):
+    """Whether exception e means the tracker failed to answer, as opposed to
+    answering with an error such as a 404"""
+    if isinstance(e, transport.HTTPError):
+        return e.status >= 500
+    return isinstance(e, (utils.web.Error, IOError, httplib.HTTPException))
+
+def format_seconds(t):
+    if t < 1:
+        return "%.2fms" % (t * 1000)
+    return "%.2fs" % t
+
+# Everything the snarfers look for contains a digit, except some OOPS ids
+snarf_prefilter = re.compile(r'\d|oops', re.I)
+def combine_regexps(res, flags):
+    """Join [(regexp, name)] into one regexp with a group per name, so a
+    message can be scanned for all of them in one pass. The name of the
+    group that matched is in match.lastgroup"""
+    L = []
+    for (r, name) in res:
+        pattern = re.sub(r'\(\?P<\w+>', '(?:', r.pattern) # Group names can't be repeated
+        L.append('(?P<%s>%s)' % (name, pattern))
+    return re.compile('|'.join(L), flags)
+
 cvere = re.compile(r'<th.*?Description.*?<td.*?>(.*?)\s*</td>', re.I | re.DOTALL)
 class Bugtracker(callbacks.PluginRegexp):
     """Show a link to a bug report with a brief description"""
-    threaded = True
+    threaded = False # Lookups run on self.pool, see get_bugs
     callBefore = ['URL']
     regexps = ['turlSnarfer', 'bugSnarfer', 'oopsSnarfer', 'cveSnarfer']
 
     def __init__(self, irc):
+        started = time.time()
         callbacks.PluginRegexp.__init__(self, irc)
+        # Scan each message once for all snarfers, see _snarf
+        self.snarf_res = dict([(name, r) for (r, name) in self.res])
+        self.res = [(combine_regexps(self.res, self.flags), '_snarf')]
         self.db = ircutils.IrcDict()
+        self.index = TrackerIndex()
 #        self.events = []
         for name in self.registryValue('bugtrackers'):
             registerBugtracker(name)
             group = self.registryValue('bugtrackers.%s' % name.replace('.','\\.'), value=False)
             if group.trackertype() in defined_bugtrackers.keys():
                 self.db[name] = defined_bugtrackers[group.trackertype()](name, group.url(), group.description())
+                if group.cachettl():
+                    self.db[name].cache_ttl = group.cachettl()
+                self.index.add(name, self.db[name])
             else:
                 self.log.warning("Bugtracker: Unknown trackertype: %s (%s)" % (group.trackertype(), name))
         self.shorthand = utils.abbrev(self.db.keys())
-        self.shown = {}
+        self.shown = RepeatGuard(self.registryValue('repeatMaxEntries'))
+        self.cache = BugCache(self.registryValue('cacheSize'), self.registryValue('cacheMaxBytes'),
+                              self.registryValue('cacheTTL'), self.registryValue('cacheNegativeTTL'),
+                              self.registryValue('staleWhileRevalidate'))
+        self.pool = FetchPool(self.registryValue('lookupThreads'), self.registryValue('trackerConcurrency'),
+                              self.registryValue('maxPendingLookups'))
+        self.cves = cveindex.CVEIndex(conf.supybot.directories.data.dirize(self.registryValue('cveIndex')))
+        try:
+            lp_duplicates.load(conf.supybot.directories.data.dirize(self.registryValue('duplicateFile')),
+                               self.registryValue('duplicateTTL'))
+        except (IOError, OSError, ValueError, TypeError), e:
+            self.log.warning("Bugtracker: Could not load the Launchpad duplicates: %s" % e)
+        TrackerHealth.configure(threshold=self.registryValue('circuitFailures'),
+                                cooldown=self.registryValue('circuitCooldown'),
+                                min_timeout=self.registryValue('httpMinTimeout'),
+                                max_timeout=self.registryValue('httpTimeout'))
+        PageScraper.configure(max_bytes=self.registryValue('pageMaxBytes'),
+                              max_time=self.registryValue('pageMaxTime'))
+        transport.pool.configure(timeout=self.registryValue('httpTimeout'),
+                                 maxidle=self.registryValue('httpMaxIdle'),
+                                 cachesize=self.registryValue('httpCacheSize'),
+                                 cachebytes=self.registryValue('httpCacheMaxBytes'))
+        if self.registryValue('metricsFile'):
+            schedule.addPeriodicEvent(self.write_metrics, self.registryValue('metricsInterval'),
+                                      name=self.name() + '.metrics', now=False)
+        self.import_time = import_time
+        self.init_time = time.time() - started
+        self.log.info("Bugtracker: Loaded %d bugtrackers in %.3fs (importing the plugin took %.3fs)" %
+                      (len(self.db), self.init_time, self.import_time))
 
 #        # Schedule bug reporting
 #        #TODO: Remove everything below this line
@@ -121,8 +685,16 @@ class Bugtracker(callbacks.PluginRegexp):
 #            self.events += [self.name() + '.bugreporter']
 #            self.log.info('Bugtracker: Adding scheduled event "%s.bugreporter"' % self.name())
 
-    def die(self): #TODO: Remove me
-        pass
+    def die(self):
+        if self.registryValue('metricsFile'):
+            try:
+                schedule.removeEvent(self.name() + '.metrics')
+            except KeyError:
+                pass
+        self.pool.stop()
+        transport.pool.clear()
+        self.cves.close()
+        lp_duplicates.save()
 #        try:
 #           for event in self.events:
 #                self.log.info('Bugtracker: Removing scheduled event "%s"' % event)
@@ -133,14 +705,7 @@ class Bugtracker(callbacks.PluginRegexp):
 
     def is_ok(self, channel, tracker, bug):
         '''Flood/repeat protection'''
-        now = time.time()
-        for k in self.shown.keys():
-            if self.shown[k] < now - self.registryValue('repeatdelay', channel):
-                self.shown.pop(k)
-        if (channel, tracker, bug) not in self.shown:
-            self.shown[(channel, tracker, bug)] = now
-            return True
-        return False
+        return self.shown.check((channel, tracker, bug), self.registryValue('repeatdelay', channel))
 
     def is_new(self, tracker, tag, id): #Depricated
         pass
@@ -254,6 +819,7 @@ class Bugtracker(callbacks.PluginRegexp):
         trackertype = trackertype.lower()
         if trackertype in defined_bugtrackers:
             self.db[name] = defined_bugtrackers[trackertype](name,url,description)
+            self.index.add(name, self.db[name])
         else:
             irc.error("Bugtrackers of type '%s' are not understood" % trackertype)
             return
@@ -271,6 +837,7 @@ class Bugtracker(callbacks.PluginRegexp):
         try:
             name = self.shorthand[name.lower()]
             del self.db[name]
+            self.index.remove(name)
             self.registryValue('bugtrackers').remove(name)
             self.shorthand = utils.abbrev(self.db.keys())
             irc.replySuccess()
@@ -293,6 +860,8 @@ class Bugtracker(callbacks.PluginRegexp):
             self.db[newname] = defined_bugtrackers[group.trackertype()](name,group.url(),d)
             registerBugtracker(newname, group.url(), d, group.trackertype())
             del self.db[name]
+            self.index.remove(name)
+            self.index.add(newname, self.db[newname])
             self.registryValue('bugtrackers').remove(name)
             self.shorthand = utils.abbrev(self.db.keys())
             irc.replySuccess()
@@ -326,8 +895,126 @@ class Bugtracker(callbacks.PluginRegexp):
                 irc.reply('I have no defined bugtrackers.')
     list = wrap(list, [additional('text')])
 
+    def cveimport(self, irc, msg, args, filename):
+        """<filename>
+
+        Load CVE descriptions from <filename>, a bulk CVE export (MITRE CSV, NVD
+        JSON or CVE JSON 5, optionally gzipped), into the local CVE index. Entries
+        already in the index are updated, so newer exports can be imported on top
+        of older ones. The export is read one record at a time, but the new
+        descriptions are held in memory until they're merged into the index.
+        """
+        def done(outcome):
+            (ok, result) = outcome
+            if ok:
+                irc.reply("Imported %d CVEs, the index now has %d" % (result, len(self.cves)))
+            elif isinstance(result, (IOError, OSError, ValueError, BugtrackerError)):
+                irc.error("Could not import %s: %s" % (filename, result))
+            else:
+                log_error("Bugtracker: Error importing %s" % filename, result)
+                irc.error("Could not import %s, the error has been logged" % filename)
+        # This takes a while, don't block the bot
+        try:
+            self.pool.submit('cveimport', lambda: self.cves.update(cveindex.read_dump(filename)), (), done)
+        except BugtrackerError, e:
+            done((False, e))
+    cveimport = wrap(cveimport, [('checkCapability', 'admin'), 'something'])
+
+    def cachestats(self, irc, msg, args):
+        """takes no arguments
+
+        Show the size and hit/miss counters of the bug report cache, and how
+        often HTTP connections and bodies were reused.
+        """
+        irc.reply("Reports: %s. HTTP: %s. Launchpad duplicates: %d known" % (self.cache.stats(), transport.pool.stats(),
+                                                                          len(lp_duplicates)))
+    cachestats = wrap(cachestats, [('checkCapability', 'admin')])
+
+    def stats(self, irc, msg, args):
+        """takes no arguments
+
+        Show how many bugs were looked up, the errors and where the time went,
+        per stage and per bugtracker.
+        """
+        self.update_metrics()
+        irc.reply(self.metrics_summary())
+    stats = wrap(stats, [('checkCapability', 'admin')])
+
+    def update_metrics(self):
+        """Copy the counters kept by the cache, the HTTP transport and the
+        circuit breakers into the metrics"""
+        for (result, n) in (('hit', self.cache.hits), ('negative', self.cache.negative_hits),
+                            ('stale', self.cache.stale_hits), ('miss', self.cache.misses)):
+            stats.set('bugtracker_cache_lookups_total', n, result=result)
+        stats.set('bugtracker_cache_evictions_total', self.cache.evictions)
+        stats.set('bugtracker_cache_coalesced_total', self.cache.coalesced)
+        stats.set('bugtracker_cache_entries', len(self.cache.entries))
+        stats.set('bugtracker_cache_bytes', self.cache.bytes)
+        for (host, n) in transport.pool.received.items():
+            stats.set('bugtracker_http_received_bytes_total', n, host=host)
+        stats.set('bugtracker_http_requests_total', transport.pool.requests)
+        stats.set('bugtracker_http_revalidated_total', transport.pool.revalidated)
+        stats.set('bugtracker_http_cache_bytes', transport.pool.bytes)
+        for (name, tracker) in self.db.items():
+            stats.set('bugtracker_circuit_open', int(tracker.health.state() != 'closed'), tracker=name)
+
+    def metrics_summary(self):
+        def timing(h):
+            p95 = h.quantile(0.95)
+            if p95 == float('inf'):
+                p95 = "over %s" % format_seconds(metrics.buckets[-1])
+            else:
+                p95 = "under %s" % format_seconds(p95)
+            return "%dx, %s avg, p95 %s" % (h.count, format_seconds(h.sum / h.count), p95)
+        stages = {}
+        trackers = {}
+        for (labels, h) in stats.select('bugtracker_stage_seconds'):
+            if 'tracker' in labels:
+                trackers.setdefault(labels['tracker'], []).append("%s %s" % (labels['stage'], timing(h)))
+            else:
+                stages[labels['stage']] = h
+        for (labels, h) in stats.select('bugtracker_soap_seconds'):
+            trackers.setdefault(labels['tracker'], []).append("soap %s %s" % (labels['phase'], timing(h)))
+        parts = ["%s %s" % (stage, timing(stages[stage])) for stage in ('regex', 'resolve') if stage in stages]
+        for (labels, n) in stats.select('bugtracker_lookups_total'):
+            name = labels['tracker']
+            errors = ["%d %s" % (e, l['type']) for (l, e) in stats.select('bugtracker_errors_total') if l['tracker'] == name]
+            parts.append("%s: %d lookups, %s; %s" % (name, n, errors and 'errors: ' + ', '.join(errors) or 'no errors',
+                                                    '; '.join(trackers.get(name, []))))
+        parts.append("received %s over HTTP" % utils.str.nItems(sum(transport.pool.received.values()), 'byte'))
+        parts.append("cache %d hits, %d misses" % (self.cache.hits + self.cache.negative_hits + self.cache.stale_hits, self.cache.misses))
+        return '. '.join(parts)
+
+    def write_metrics(self):
+        path = conf.supybot.directories.data.dirize(self.registryValue('metricsFile'))
+        try:
+            self.update_metrics()
+            stats.write(path)
+        except Exception, e:
+            self.log.warning("Bugtracker: Could not write metrics to %s: %s" % (path, e))
+
+    def doPrivmsg(self, irc, msg):
+        started = time.time()
+        if snarf_prefilter.search(msg.args[1]):
+            msg.tag('snarftime', 0.0)
+            callbacks.PluginRegexp.doPrivmsg(self, irc, msg)
+            # What's left after the snarfers themselves is the regexp matching
+            started += msg.tagged('snarftime')
+        stats.observe('bugtracker_stage_seconds', time.time() - started, stage='regex')
+
+    def _snarf(self, irc, msg, match):
+        # Re-match with the snarfer's own regexp to get its named groups back
+        name = match.lastgroup
+        m = self.snarf_res[name].match(match.string, match.start())
+        if m:
+            started = time.time()
+            try:
+                getattr(self, name)(irc, msg, m)
+            finally:
+                msg.tag('snarftime', (msg.tagged('snarftime') or 0.0) + time.time() - started)
+
     def bugSnarfer(self, irc, msg, match):
-        r"""\b(?P<bt>(([a-z0-9]+)?\s+bugs?|[a-z0-9]+)):?\s+#?(?P<bug>\d+(?!\d*[\-\.]\d+)((,|\s*(and|en|et|und|ir))\s*#?\d+(?!\d*[\-\.]\d+))*)"""
+        r"""\b(?P<bt>(([a-z0-9]+)?\s+bugs?|[a-z0-9]+)):?\s+#?(?P<bug>\d+(?!\d|[\-\.]\d)((,|\s*(and|en|et|und|ir))\s*#?\d+(?!\d|[\-\.]\d))*)"""
         channel = ircutils.isChannel(msg.args[0]) and msg.args[0] or None
         if not self.registryValue('bugSnarfer', channel):
             return
@@ -361,9 +1048,17 @@ class Bugtracker(callbacks.PluginRegexp):
         if not sure_bug:
             bugids = [x for x in bugids if int(x) > 100]
 
-        bugids = list(set(bugids)) ## remove dups
+        ## remove dups, keeping the order they were given in
+        seen = set()
+        unique = []
+        for bugid in bugids:
+            if bugid not in seen:
+                seen.add(bugid)
+                unique.append(bugid)
+        bugids = unique
 
         msg.tag('nbugs', nbugs + len(bugids))
+        resolve_started = time.time()
         bt = map(lambda x: x.lower(), match.group('bt').split())
         # Strip off trailing ':' from the tracker name. Allows for (LP: #nnnnnn)
         if bt and bt[0].endswith(':'):
@@ -400,23 +1095,32 @@ class Bugtracker(callbacks.PluginRegexp):
             s = self.registryValue('replyNoBugtracker', name)
             irc.error(s % name)
         else:
-            for bugid in bugids:
-                bugid = int(bugid)
-                try:
-                    report = self.get_bug(channel,tracker,bugid,self.registryValue('showassignee', channel), show_tracker=showTracker)
-                except BugNotFoundError:
-                    if self.registryValue('replyWhenNotFound'):
-                        irc.error("%s bug %d could not be found" % (tracker.description, bugid))
-                except BugtrackerError, e:
-#                    if 'private' in str(e):
-#                        irc.reply("Bug %d on http://launchpad.net/bugs/%d is private" % (bugid, bugid))
-#                        return
-                    if not sure_bug and bugid < 30:
-                        return
-                    irc.error(str(e))
-                else:
-                    for r in report:
-                        irc.reply(makeClean(r), prefixNick=False)
+            stats.observe('bugtracker_stage_seconds', time.time() - resolve_started, stage='resolve')
+            bugids = [int(bugid) for bugid in bugids]
+            def reply(results):
+                with stats.timer('bugtracker_stage_seconds', stage='reply', tracker=tracker.name):
+                    for (bugid, (ok, report)) in zip(bugids, results):
+                        if not ok:
+                            e = report
+                            if isinstance(e, BugNotFoundError):
+                                if self.registryValue('replyWhenNotFound'):
+                                    irc.error("%s bug %d could not be found" % (tracker.description, bugid))
+                                continue
+                            if not isinstance(e, BugtrackerError):
+                                log_error("Bugtracker: Error looking up %s bug %d" % (tracker.description, bugid), e)
+                                continue
+#                            if 'private' in str(e):
+#                                irc.reply("Bug %d on http://launchpad.net/bugs/%d is private" % (bugid, bugid))
+#                                return
+                            if not sure_bug and bugid < 30:
+                                return
+                            irc.error(str(e))
+                        else:
+                            for r in report:
+                                irc.reply(r, prefixNick=False)
+            # Fetch them all at once, but reply in the order they were given
+            self.get_bugs(channel, tracker, bugids, self.registryValue('showassignee', channel), reply,
+                          show_tracker=showTracker)
 
     def turlSnarfer(self, irc, msg, match):
         r"(?P<tracker>https?://\S*?)/(?:Bugs/0*|str.php\?L|show_bug.cgi\?id=|bugreport.cgi\?bug=|(?:bugs|\+bug)/|ticket/|tracker/|\S*aid=|bug=)?(?P<bug>\d+)(?P<sfurl>&group_id=\d+&at_id=\d+)?"
@@ -428,18 +1132,35 @@ class Bugtracker(callbacks.PluginRegexp):
         if nbugs >= 5:
             return
         msg.tag('nbugs', nbugs+1)
-        try:
-            tracker = self.get_tracker(match.group(0),match.group('sfurl'))
-            if not tracker:
+        bugid = int(match.group('bug'))
+        def reply(tracker, results):
+            (ok, report) = results[0]
+            if not ok:
+                if isinstance(report, BugNotFoundError):
+                    irc.error("%s bug %s not found" % (tracker, bugid))
+                elif isinstance(report, BugtrackerError):
+                    irc.error(str(report))
+                else:
+                    log_error("Bugtracker: Error looking up %s bug %s" % (tracker.description, bugid), report)
                 return
-            report = self.get_bug(channel, tracker, int(match.group('bug')), self.registryValue('showassignee', channel), do_url = False)
-        except BugtrackerError, e:
-            irc.error(str(e))
-        except BugNotFoundError, e:
-            irc.error("%s bug %s not found" % (tracker, match.group('bug')))
-        else:
-            for r in report:
-                irc.reply(makeClean(r), prefixNick=False)
+            with stats.timer('bugtracker_stage_seconds', stage='reply', tracker=tracker.name):
+                for r in report:
+                    irc.reply(r, prefixNick=False)
+        def resolve(url, sfurl):
+            with stats.timer('bugtracker_stage_seconds', stage='resolve'):
+                return self.get_tracker(url, sfurl)
+        def resolved(outcome):
+            (ok, tracker) = outcome
+            if not ok:
+                raise tracker
+            if tracker:
+                self.get_bugs(channel, tracker, [bugid], self.registryValue('showassignee', channel),
+                              lambda results: reply(tracker, results), do_url = False)
+        # Finding the tracker can take a request (bugzilla auto-discovery)
+        try:
+            self.pool.submit('resolve', resolve, (match.group(0), match.group('sfurl')), resolved)
+        except BugtrackerError, e: # The pool is full or stopped
+            self.log.warning("Bugtracker: Not looking up %s: %s" % (match.group(0), e))
 
     # Only useful for launchpad developers
     def oopsSnarfer(self, irc, msg, match):
@@ -463,13 +1184,27 @@ class Bugtracker(callbacks.PluginRegexp):
         if not self.is_ok(channel, 'cve', cve):
             return
         url = 'http://cve.mitre.org/cgi-bin/cvename.cgi?name=%s' % cve
-        cvedata = utils.web.getUrl(url)
-        m = cvere.search(cvedata)
-        if m:
-            cve = m.group(1).replace('\n', ' ')
-            if len(cve) > 380:
-                cve = cve[:380] + '...'
-            irc.reply("%s (%s)" % (cve,url), prefixNick=False)
+        def reply(description):
+            if description:
+                if len(description) > 380:
+                    description = description[:380] + '...'
+                irc.reply("%s (%s)" % (description,url), prefixNick=False)
+        def scraped(outcome):
+            (ok, page) = outcome
+            if not ok:
+                self.log.warning("Bugtracker: Could not get %s: %s" % (url, page))
+                return
+            m = cvere.search(page)
+            if m:
+                reply(m.group(1).replace('\n', ' '))
+        description = self.cves.lookup(cve)
+        if description is not None:
+            return reply(description)
+        # Not in the local index (yet)
+        try:
+            self.pool.submit('cve', transport.pool.get, (url,), scraped)
+        except BugtrackerError, e: # The pool is full or stopped
+            self.log.warning("Bugtracker: Not looking up %s: %s" % (cve, e))
 
 #TODO: as we will depend on launchpadlib, we should consider using lazr.uri.URI to do URL parsing
     def get_tracker(self, snarfurl, sfdata):
@@ -497,25 +1232,12 @@ class Bugtracker(callbacks.PluginRegexp):
         if '/' in snarfurl:
             snarfhost = snarfhost[:snarfhost.index('/')]
 
-        if 'sourceforge.net' in snarfurl: # See below
+        if 'sourceforge.net' in snarfurl: # See TrackerIndex.add
             return None
 
-        for t in self.db.keys():
-            tracker = self.db.get(t, None)
-            if not tracker:
-                self.log.error("No tracker for key %r" % t)
-                continue
-            url = tracker.url.replace('http://','').replace('https://','')
-
-            if 'sourceforge.net' in url:
-                # sourceforge.net has no API or structured bug exporting, HTML
-                # scraping is not good enough. Especially as SF keep changing it
-                continue
-
-            if '/' in url:
-                url = url[:url.index('/')]
-            if url in snarfhost:
-                return tracker
+        tracker = self.index.lookup(snarfurl)
+        if tracker:
+            return tracker
 
         if snarfhost == 'pad.lv': # Launchpad URL shortening
             return self.db.get('lp', None)
@@ -525,56 +1247,187 @@ class Bugtracker(callbacks.PluginRegexp):
             tracker = Bugzilla().get_tracker(snarfurl)
             if tracker:
                 self.db[tracker.name] = tracker
+                self.index.add(tracker.name, tracker)
                 self.shorthand = utils.abbrev(self.db.keys())
                 return tracker
         return None
 
-    def get_bug(self, channel, tracker, id, do_assignee, do_url = True, show_tracker = True):
+    def get_bugs(self, channel, tracker, ids, do_assignee, callback, do_url = True, show_tracker = True):
+        """Look up several bugs on the same tracker without blocking. Cached
+        reports are used right away, the others are fetched by the lookup
+        pool. callback gets a list of (ok, reports-or-exception) in the order
+        of ids, possibly from one of the pool's threads"""
+        wanted = [id for id in ids if self.is_ok(channel, tracker, id)]
+        stats.inc('bugtracker_lookups_total', len(wanted), tracker=tracker.name)
+        (results, misses) = self.cache.lookup_many(tracker, wanted, tracker.fetch_bug, self.pool.submit)
+        def finish():
+            ret = []
+            for id in ids:
+                (ok, result) = results.get(id, (True, []))
+                if not ok:
+                    stats.inc('bugtracker_errors_total', tracker=tracker.name, type=result.__class__.__name__)
+                elif result:
+                    result = self.format_reports(channel, tracker, result, do_assignee, do_url, show_tracker)
+                ret.append((ok, result))
+            callback(ret)
+        if not misses:
+            return finish()
+
+        # Bugs that are already being fetched for someone else arrive one by
+        # one through waiter, the ones we fetch ourselves all at once
+        lock = threading.Lock()
+        outstanding = [0]
+        def arrived(fetched):
+            lock.acquire()
+            try:
+                for (id, result) in fetched.items():
+                    results[id] = (not isinstance(result, Exception), result)
+                outstanding[0] -= 1
+                done = not outstanding[0]
+            finally:
+                lock.release()
+            if done:
+                finish()
+        def waiter(id, result):
+            arrived({id: result})
+        def fetched_many(outcome):
+            (ok, result) = outcome
+            if not ok:
+                result = dict([(id, result) for id in own])
+            arrived(self.cache.fill(tracker, own, result))
+        def fetched_each(outcomes):
+            arrived(self.cache.fill(tracker, own, dict([(id, result) for (id, (ok, result)) in zip(own, outcomes)])))
+        lock.acquire()
+        try:
+            own = self.cache.claim(tracker, misses, waiter)
+            outstanding[0] = len(misses) - len(own) + (own and 1 or 0)
+        finally:
+            lock.release()
+        if not own:
+            return
+        try:
+            if tracker.batched or len(own) == 1:
+                self.pool.submit(tracker.url, tracker.fetch_bugs, (own,), fetched_many)
+            else:
+                self.pool.map_async(tracker.url, tracker.fetch_bug, own, fetched_each)
+        except BugtrackerError, e: # The pool is full or stopped
+            fetched_many((False, e))
+
+    def format_reports(self, channel, tracker, bugs, do_assignee, do_url = True, show_tracker = True):
+        """Turn report tuples from a tracker into (censored) reply lines"""
+        with stats.timer('bugtracker_stage_seconds', stage='render', tracker=tracker.name):
+            return self._format_reports(channel, tracker, bugs, do_assignee, do_url, show_tracker)
+
+    def _format_reports(self, channel, tracker, bugs, do_assignee, do_url = True, show_tracker = True):
+        showext = self.registryValue('extended', channel)
+        templates = (report_templates[(showext, False)], report_templates[(showext, True)])
+        fields = {'tracker': show_tracker and tracker.description + ' ' or '', 'extinfo': ''}
         reports = []
-        if not self.is_ok(channel, tracker, id):
-            return []
-        for r in tracker.get_bug(id):
-            showext = self.registryValue('extended', channel)
-            extinfo = ''
+        for r in bugs:
+            (fields['id'], product, fields['title'], severity, status, assignee, url) = r[:7]
             if len(r) == 8:
-                (bid, product, title, severity, status, assignee, url, extinfo) = r
-            else:
-                (bid, product, title, severity, status, assignee, url) = r
-
-            severity = severity[0].upper() + severity[1:].lower()
-            status = status[0].upper() + status[1:].lower()
-            tracker_name = tracker.description + ' '
-            if not do_url:
-                url = ''
-            if not show_tracker:
-                tracker_name = ''
-            if product:
-                if showext:
-                    reports.append("%sbug %s in %s \"%s\" %s [%s,%s] %s" % (tracker_name, bid, product, 
-                                                                          title, extinfo, severity, status, url))
-                else:
-                    reports.append("%sbug %s in %s \"%s\" [%s,%s] %s" % (tracker_name, bid, product, 
-                                                                          title, severity, status, url))
-            else:
-                if showext:
-                    reports.append("%sbug %s \"%s\" %s [%s,%s] %s" % (tracker_name, bid, title, extinfo, severity, status, url))
-                else:
-                    reports.append("%sbug %s \"%s\" [%s,%s] %s" % (tracker_name, bid, title, severity, status, url))
+                fields['extinfo'] = r[7]
+            fields['product'] = product
+            fields['severity'] = severity.capitalize()
+            fields['status'] = status.capitalize()
+            fields['url'] = do_url and url or ''
+            report = templates[bool(product)] % fields
             if do_assignee and assignee:
-                reports[-1] = reports[-1] + (" - Assigned to %s" % assignee)
+                report = "%s - Assigned to %s" % (report, assignee)
+            reports.append(makeClean(report))
         return reports
 
 # Define all bugtrackers
 class IBugtracker:
+    cache_ttl = 0     # Seconds to cache reports, 0 means use the cacheTTL setting
+    batched   = False # Whether get_bugs fetches several bugs in one request
+
     def __init__(self, name=None, url=None, description=None):
         self.name        = name
         self.url         = url
         self.description = description
         self.log         = supylog # Convenience log wrapper
+        self.health      = get_health(url)
+        self.local       = threading.local() # Time spent on requests by this thread
+
+    def call(self, func, *args, **kwargs):
+        """Make a request to the tracker by calling func, recording its
+        latency and outcome in self.health"""
+        started = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception, e:
+            elapsed = self.requested(started)
+            if self.health.record(elapsed, not self.is_outage(e)):
+                self.log.warning("Bugtracker: %s is not responding (%s), not trying it for %d seconds" %
+                                 (self.description, e, self.health.cooldown))
+            raise
+        self.health.record(self.requested(started), True)
+        return result
+
+    def is_outage(self, e):
+        """Whether e counts as a failure of the tracker, see is_outage.
+        Trackers that answer some lookups with an error status override this"""
+        return is_outage(e)
+
+    def requested(self, started):
+        elapsed = time.time() - started
+        stats.observe('bugtracker_stage_seconds', elapsed, stage='fetch', tracker=self.name)
+        self.local.fetching = getattr(self.local, 'fetching', 0.0) + elapsed
+        return elapsed
+
+    def timed(self, func, arg):
+        """func(arg), recording the time not spent on requests as parsing"""
+        self.local.fetching = 0.0
+        started = time.time()
+        try:
+            return func(arg)
+        finally:
+            stats.observe('bugtracker_stage_seconds', max(0.0, time.time() - started - self.local.fetching),
+                          stage='parse', tracker=self.name)
+
+    def get_url(self, url, headers=None):
+        """Fetch url over the shared keep-alive connection pool"""
+        return self.call(transport.pool.get, url, headers, self.health.timeout())
+
+    def open_url(self, url, headers=None):
+        """Like get_url, but returns a file-like object to read the body from"""
+        return self.call(transport.pool.open, url, headers, self.health.timeout())
+
+    def soap_post(self, url, body, headers=None):
+        """POST a SOAP request over the connection pool, see soap.Method.call"""
+        return self.call(soap.post, url, body, headers, self.health.timeout())
+
+    def check_health(self):
+        """Raise BugtrackerError while the tracker is considered down"""
+        retry = self.health.allow()
+        if retry:
+            raise BugtrackerError, "%s is not responding, trying again in %d seconds" % (self.description, retry)
+
+    def fetch_bug(self, id):
+        """get_bug, failing fast while the tracker is down"""
+        self.check_health()
+        return self.timed(self.get_bug, id)
+
+    def fetch_bugs(self, ids):
+        """get_bugs, failing fast while the tracker is down"""
+        self.check_health()
+        return self.timed(self.get_bugs, ids)
 
     def get_bug(self, id):
         raise BugTrackerError("Bugtracker class does not implement get_bug")
 
+    def get_bugs(self, ids):
+        """Returns {id: reports-or-exception}. Trackers that can fetch several
+        bugs in one request override this and set batched"""
+        results = {}
+        for id in ids:
+            try:
+                results[id] = self.get_bug(id)
+            except (BugNotFoundError, BugtrackerError), e:
+                results[id] = e
+        return results
+
     def get_tracker(self, url):
         raise BugTrackerError("Bugtracker class does not implement get_tracker")
 
@@ -590,13 +1443,108 @@ class IBugtracker:
     def __str__(self):
         return self.name
 
+class _StopParsing(Exception):
+    pass
+
+class ZillaParser:
+    """Incremental parser for show_bug.cgi?ctype=xml output. It only keeps the
+    fields we report on and stops as soon as all requested bugs have them, so
+    comments and attachments are never read, let alone parsed."""
+    fields = ('bug_id', 'short_desc', 'bug_status', 'resolution', 'component', 'bug_severity', 'assigned_to')
+    stop_at = ('long_desc', 'attachment') # Everything we need comes before these
+
+    def __init__(self, nbugs):
+        self.nbugs   = nbugs
+        self.urlbase = None
+        self.bugs    = [] # One dict of field -> text per <bug>
+        self.done    = False
+        self.current = None
+        self.field   = None
+        self.text    = []
+        self.base64  = False
+        self.depth   = 0
+        self.parser  = expat.ParserCreate()
+        self.parser.StartElementHandler  = self._start
+        self.parser.EndElementHandler    = self._end
+        self.parser.CharacterDataHandler = self._data
+        self.parser.buffer_text = True
+
+    def _bug_done(self):
+        self.current = None
+        if len(self.bugs) >= self.nbugs:
+            self.done = True
+            raise _StopParsing
+
+    def _start(self, name, attrs):
+        self.depth += 1
+        if name == 'bugzilla':
+            self.urlbase = attrs.get('urlbase')
+            if not self.nbugs:
+                self.done = True
+                raise _StopParsing
+        elif name == 'bug':
+            self.current = {}
+            if attrs.get('error'):
+                self.current['error'] = attrs['error']
+            self.bugs.append(self.current)
+        elif self.current is not None and self.depth == 3:
+            if name in self.fields:
+                self.field  = name
+                self.text   = []
+                self.base64 = attrs.get('encoding') == 'base64'
+            elif name in self.stop_at:
+                self._bug_done()
+
+    def _data(self, data):
+        if self.field:
+            self.text.append(data)
+
+    def _end(self, name):
+        self.depth -= 1
+        if self.field and name == self.field:
+            val = u''.join(self.text)
+            if self.base64:
+                try:
+                    val = val.decode('base64')
+                except:
+                    val = 'Cannot convert bug data from base64.'
+            self.current[name] = _decode_entities(val)
+            self.field = None
+            if len(self.current) == len(self.fields):
+                self._bug_done()
+        elif name == 'bug' and self.current is not None:
+            self._bug_done()
+
+    def feed(self, data):
+        """Feed a chunk of the document, returns True when no more is needed"""
+        if not self.done:
+            try:
+                self.parser.Parse(data, False)
+            except _StopParsing:
+                pass
+        return self.done
+
+    def parse(self, fd, chunksize=8192):
+        try:
+            while True:
+                data = fd.read(chunksize)
+                if not data:
+                    if not self.done:
+                        self.parser.Parse('', True)
+                    break
+                if self.feed(data):
+                    break
+        finally:
+            fd.close()
+        return self
+
 class Bugzilla(IBugtracker):
+    batched = True # show_bug.cgi takes several id= parameters
+
     def get_tracker(self, url):
         url += '&ctype=xml'
         try:
-            bugxml = utils.web.getUrl(url)
-            tree = minidom.parseString(bugxml)
-            url  = str(tree.getElementsByTagName('bugzilla')[0].attributes['urlbase'].childNodes[0].data)
+            url = str(ZillaParser(0).parse(self.open_url(url)).urlbase)
             if url[-1] == '/':
                 url = url[:-1]
             name = url[url.find('//') + 2:]
@@ -609,34 +1557,54 @@ class Bugzilla(IBugtracker):
         except:
             return None
     def get_bug(self, id):
-        url = "%s/show_bug.cgi?id=%d&ctype=xml" % (self.url,id)
+        result = self.get_bugs([id])[id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_bugs(self, ids):
+        url = "%s/show_bug.cgi?%s&ctype=xml" % (self.url, '&'.join(['id=%d' % id for id in ids]))
         try:
-            bugxml = utils.web.getUrl(url)
-            zilladom = minidom.parseString(bugxml)
+            bugs = ZillaParser(len(ids)).parse(self.open_url(url)).bugs
         except Exception, e:
             s = 'Could not parse XML returned by %s: %s (%s)' % (self.description, e, url)
             raise BugtrackerError, s
-        bug_n = zilladom.getElementsByTagName('bug')[0]
-        if bug_n.hasAttribute('error'):
-            errtxt = bug_n.getAttribute('error')
+        results = {}
+        # Bugs come back in the order they were asked for, but use bug_id when we can
+        for (n, bug_n) in enumerate(bugs):
+            id = n < len(ids) and ids[n] or None
+            try:
+                bug_id = int(bug_n['bug_id'])
+                if bug_id in ids:
+                    id = bug_id
+            except (KeyError, ValueError):
+                pass
+            if id is None:
+                continue
+            try:
+                results[id] = self._parse_bug(bug_n, id, url)
+            except (BugNotFoundError, BugtrackerError), e:
+                results[id] = e
+        for id in ids:
+            if id not in results:
+                results[id] = BugNotFoundError()
+        return results
+
+    def _parse_bug(self, bug_n, id, url):
+        if 'error' in bug_n:
+            errtxt = bug_n['error']
             if errtxt == 'NotFound':
                 raise BugNotFoundError
             s = 'Error getting %s bug #%s: %s' % (self.description, id, errtxt)
             raise BugtrackerError, s
         try:
-            title = _getnodetxt(bug_n.getElementsByTagName('short_desc')[0])
-            status = _getnodetxt(bug_n.getElementsByTagName('bug_status')[0])
-            try:
-                status = "%s: %s" % (status, _getnodetxt(bug_n.getElementsByTagName('resolution')[0]))
-            except:
-                pass
-            component = _getnodetxt(bug_n.getElementsByTagName('component')[0])
-            severity = _getnodetxt(bug_n.getElementsByTagName('bug_severity')[0])
-            assignee = '(unavailable)'
-            try:
-                assignee = _getnodetxt(bug_n.getElementsByTagName('assigned_to')[0])
-            except:
-                pass
+            title = bug_n['short_desc']
+            status = bug_n['bug_status']
+            if bug_n.get('resolution'):
+                status = "%s: %s" % (status, bug_n['resolution'])
+            component = bug_n['component']
+            severity = bug_n['bug_severity']
+            assignee = bug_n.get('assigned_to') or '(unavailable)'
         except Exception, e:
             s = 'Could not parse XML returned by %s bugzilla: %s (%s)' % (self.description, e, url)
             raise BugtrackerError, s
@@ -674,13 +1642,17 @@ class Issuezilla(Bugzilla):
 #            raise BugtrackerError, s
 #        return [(id, component, title, severity, status, assignee, "%s/show_bug.cgi?id=%d" % (self.url, id))]
 
-class Launchpad(IBugtracker):
-    statuses = ["Unknown", "Invalid", "Opinion", "Won't Fix", "Fix Released", "Fix Committed", "New", "Incomplete", "Confirmed", "Triaged", "In Progress"]
-    severities = ["Unknown", "Undecided", "Wishlist", "Low", "Medium", "High", "Critical"]
+# launchpadlib clients by service root, None if launchpadlib isn't installed.
+# Logging in downloads and parses the WADL description of the web service, so
+# only do that once per service root, and only when a bug is looked up.
+lp_clients = {}
+lp_clients_lock = threading.Lock()
 
-    def __init__(self, *args, **kwargs):
-        IBugtracker.__init__(self, *args, **kwargs)
-        self.lp = None
+def get_lp_client(service_root):
+    lp_clients_lock.acquire()
+    try:
+        if service_root in lp_clients:
+            return lp_clients[service_root]
 
         # A word to the wise:
         # The Launchpad API is much better than the /+text interface we currently use,
@@ -693,57 +1665,281 @@ class Launchpad(IBugtracker):
         try: # Attempt to use launchpadlib, python bindings for the Launchpad API
             from launchpadlib.launchpad import Launchpad
             cachedir = os.path.join(conf.supybot.directories.data.tmp(), 'lpcache')
+            if service_root == 'https://api.launchpad.net/':
+                root = 'production'
+            else:
+                root = service_root
             if hasattr(Launchpad, 'login_anonymously'):
-                self.lp = Launchpad.login_anonymously("Ubuntu Bots - Bugtracker", 'production', cachedir)
+                lp = Launchpad.login_anonymously("Ubuntu Bots - Bugtracker", root, cachedir)
             else: #NOTE: Most people should have a launchpadlib new enough for .login_anonymously
-                self.lp = Launchpad.login("Ubuntu Bots - Bugtracker", '', '', 'production', cahedir)
+                lp = Launchpad.login("Ubuntu Bots - Bugtracker", '', '', root, cachedir)
         except ImportError:
             # Ask for launchpadlib to be installed
             supylog.warning("Please install python-launchpadlib, the old interface is deprecated")
-        except Exception: # Something unexpected happened
-            self.lp = None
+            lp = None
+        except Exception: # Something unexpected happened, try again next time
             supylog.exception("Unknown exception while accessing the Launchpad API")
+            return None
+        lp_clients[service_root] = lp
+        return lp
+    finally:
+        lp_clients_lock.release()
+
+class LPEntry(dict):
+    """A Launchpad web service entry, with attribute access like a launchpadlib
+    object. Missing attributes are None."""
+    def __getattr__(self, name):
+        return self.get(name)
+
+class DuplicateMap:
+    """Persistent map of Launchpad duplicates to the bug at the end of their
+    duplicate chain, so a duplicate costs one fetch instead of one per hop.
+    Entries expire after ttl seconds and are dropped as soon as the master
+    turns out to be gone. The duplicate itself is not fetched while its entry
+    lasts, an expired entry makes the next lookup follow (and check) the
+    whole chain again. The map is kept in a JSON file, written at most
+    every save_interval seconds and when the plugin is unloaded."""
+    save_interval = 300
+
+    def __init__(self, path=None, ttl=0):
+        self.path    = path
+        self.ttl     = ttl # 0 disables the map
+        self.entries = {} # (api root, duplicate) -> (master, stored at)
+        self.dirty   = False
+        self.saved   = time.time()
+        self.lock    = threading.Lock()
+
+    def load(self, path, ttl):
+        self.lock.acquire()
+        try:
+            (self.path, self.ttl, self.entries, self.dirty) = (path, ttl, {}, False)
+            if not ttl or not os.path.exists(path):
+                return
+            fd = open(path)
+            try:
+                data = json.load(fd)
+            finally:
+                fd.close()
+            now = time.time()
+            for (root, duplicates) in data.get('duplicates', {}).items():
+                for (id, (master, stored)) in duplicates.items():
+                    if stored + ttl > now:
+                        self.entries[(root, int(id))] = (master, stored)
+        finally:
+            self.lock.release()
+
+    def get(self, root, id):
+        """The master of duplicate id, or None"""
+        if not self.ttl:
+            return None
+        self.lock.acquire()
+        try:
+            entry = self.entries.get((root, id))
+            if entry is None:
+                return None
+            if entry[1] + self.ttl <= time.time():
+                del self.entries[(root, id)]
+                self.dirty = True
+                return None
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def set(self, root, id, master):
+        if not self.ttl:
+            return
+        self.lock.acquire()
+        try:
+            self.entries[(root, id)] = (master, time.time())
+            self.dirty = True
+        finally:
+            self.lock.release()
+        if time.time() - self.saved > self.save_interval:
+            self.save()
+
+    def forget(self, root, id):
+        self.lock.acquire()
+        try:
+            if self.entries.pop((root, id), None) is not None:
+                self.dirty = True
+        finally:
+            self.lock.release()
+
+    def save(self):
+        """Write the map to its file if it changed, atomically"""
+        self.lock.acquire()
+        try:
+            if not self.dirty or not self.path:
+                return
+            duplicates = {}
+            for ((root, id), entry) in self.entries.items():
+                duplicates.setdefault(root, {})[str(id)] = entry
+            (self.dirty, self.saved) = (False, time.time())
+            path = self.path
+        finally:
+            self.lock.release()
+        tmp = path + '.tmp'
+        try:
+            fd = open(tmp, 'w')
+            try:
+                json.dump({'duplicates': duplicates}, fd)
+            finally:
+                fd.close()
+            os.rename(tmp, path)
+        except (IOError, OSError), e:
+            supylog.warning("Bugtracker: Could not save Launchpad duplicates to %s: %s" % (path, e))
+
+    def __len__(self):
+        return len(self.entries)
+
+lp_duplicates = DuplicateMap() # Shared by all Launchpad trackers, see Bugtracker.__init__
+
+class Launchpad(IBugtracker):
+    cache_ttl = 120 # Launchpad bugs get triaged a lot, don't keep them around too long
+    statuses = ["Unknown", "Invalid", "Opinion", "Won't Fix", "Fix Released", "Fix Committed", "New", "Incomplete", "Confirmed", "Triaged", "In Progress"]
+    severities = ["Unknown", "Undecided", "Wishlist", "Low", "Medium", "High", "Critical"]
+    # Rank of every status and importance, anything not in them ranks above all
+    status_rank = dict([(s, i) for (i, s) in enumerate(statuses)])
+    severity_rank = dict([(s, i) for (i, s) in enumerate(severities)])
+    task_page_size = 300 # The most the web service returns in one page
+
+    json_headers = {'Accept': 'application/json'}
+
+    def __init__(self, *args, **kwargs):
+        IBugtracker.__init__(self, *args, **kwargs)
+        if self.url:
+            (scheme, host) = self.url.split('://', 1)
+            host = host.split('/')[0]
+            if host.startswith('bugs.'):
+                host = host[5:]
+            self.api_root = "%s://api.%s/1.0" % (scheme, host)
+        else:
+            self.api_root = None
+
+    def get_lp(self):
+        """The launchpadlib client for this tracker's service root, shared by
+        all trackers with the same url and only created when first needed"""
+        if not self.api_root:
+            return None
+        return get_lp_client(self.api_root[:self.api_root.rfind('/') + 1])
 
     def _parse(self, task): #Depricated
+        import email.FeedParser
         parser = email.FeedParser.FeedParser()
         parser.feed(task)
         return parser.close()
 
     def get_bug(self, id): #TODO: Remove this method and rename 'get_new_bug' to 'get_bug'
-        if self.lp:
+        try:
+            return self.get_bug_json(id)
+        except (BugNotFoundError, BugtrackerError):
+            raise
+        except Exception: # Launchpad changed again?
+            supylog.exception("Error using the Launchpad web service directly for %s bug #%d" % (self.description, id))
+        if self.get_lp():
             return self.get_bug_new(id)
         return self.get_bug_old(id)
 
+    def _choose_task(self, tasks):
+        """Pick the task to report on: the one with the highest status, then
+        the highest importance, see _rank. Ties go to the last one. tasks can
+        be any iterable, it is only gone over once"""
+        best = best_rank = None
+        for task in tasks:
+            rank = self._rank(task)
+            if best is None or rank >= best_rank:
+                (best, best_rank) = (task, rank)
+        return best
+
     @classmethod
-    def _sort(cls, task1, task2):
-        task1_status = task1.status
-        task1_importance = task1.importance
-        task2_status = task2.status
-        task2_importance = task2.importance
-
-        if task1_status not in cls.statuses:
-            supylog.error("%r is an unknown status for Launchapd, update %s.statuses" % (task1_status, getattr(cls, '__name__', 'Launchpad')))
-            if task2_status not in cls.statuses:
-                supylog.error("%r is an unknown status for Launchapd, update %s.statuses" % (task1_status, getattr(cls, '__name__', 'Launchpad')))
-                return -1
-            return 1
-
-        if task1_importance not in cls.severities:
-            supylog.error("%r is an unknown status for Launchapd, update %s.severities" % (task1_importance, getattr(cls, '__name__', 'Launchpad')))
-            if task2_importance not in cls.severities:
-                supylog.error("%r is an unknown status for Launchapd, update %s.severities" % (task1_importance, getattr(cls, '__name__', 'Launchpad')))
-                return -1
-            return 1
-
-        if task1_status != task2_status:
-            if cls.statuses.index(task1_status) < cls.statuses.index(task2_status):
-                return -1
-            return 1
-        if task1_importance != task2_importance:
-            if cls.severities.index(task1_importance) < cls.severities.index(task2_importance):
-                return -1
-            return 1
-        return 0
+    def _rank(cls, task):
+        status = cls.status_rank.get(task.status)
+        if status is None:
+            supylog.error("%r is an unknown status for Launchpad, update %s.statuses" % (task.status, cls.__name__))
+            status = len(cls.statuses)
+        importance = cls.severity_rank.get(task.importance)
+        if importance is None:
+            supylog.error("%r is an unknown importance for Launchpad, update %s.severities" % (task.importance, cls.__name__))
+            importance = len(cls.severities)
+        return (status, importance)
+
+    def get_bug_json(self, id):
+        """Get a bug straight from the Launchpad web service, without going
+        through launchpadlib's lazy objects. This takes one request for the
+        bug, one per duplicate hop (or just one for the master of a known
+        duplicate, see DuplicateMap), one per page of tasks (of up to
+        task_page_size tasks) and one for the assignee, they are counted in
+        bugtracker_launchpad_requests_total. The web service can't filter a
+        bug's tasks, so they are all read, but only the best one so far is
+        kept."""
+        requests = [0]
+        def get(url):
+            requests[0] += 1
+            return LPEntry(json.loads(self.get_url(url, self.json_headers)))
+
+        try:
+            bugdata = None
+            summary_prefix = '' # Used to made dups easier
+            master = lp_duplicates.get(self.api_root, id)
+            if master:
+                try:
+                    bugdata = get("%s/bugs/%d" % (self.api_root, master))
+                    summary_prefix = 'duplicate for #%d ' % id
+                except utils.web.Error, e:
+                    if '404' not in str(e):
+                        raise
+                    lp_duplicates.forget(self.api_root, id) # Follow the chain from the start instead
+            if bugdata is None:
+                try:
+                    bugdata = get("%s/bugs/%d" % (self.api_root, id))
+                except utils.web.Error, e:
+                    if '404' in str(e): # Private bugs are hidden from anonymous users, same reply as get_bug_new
+                        raise BugtrackerError, "Bug #%s (%s/bugs/%d) is private or doesn't exist" % (id, self.url, id)
+                    raise
+                if bugdata.private:
+                    raise BugtrackerError, "This bug is private"
+
+            hops = 0
+            while bugdata.duplicate_of_link and hops < 10:
+                summary_prefix = 'duplicate for #%d ' % id
+                hops += 1
+                try:
+                    bugdata = get(bugdata.duplicate_of_link)
+                except utils.web.Error, e:
+                    if '404' in str(e):
+                        bugNo = bugdata.duplicate_of_link.rstrip('/').split('/')[-1]
+                        raise BugtrackerError, 'Bug #%s is a duplicate of bug #%s, but it is private (%s/bugs/%s)' % (id, bugNo, self.url, bugNo)
+                    raise
+            if summary_prefix and not bugdata.duplicate_of_link and bugdata.id != master:
+                lp_duplicates.set(self.api_root, id, bugdata.id)
+
+            def tasks():
+                link = bugdata.bug_tasks_collection_link
+                link += "%sws.size=%d" % ('?' in link and '&' or '?', self.task_page_size)
+                while link:
+                    page = get(link)
+                    for task in page.entries or []:
+                        yield LPEntry(task)
+                    link = page.next_collection_link
+            taskdata = self._choose_task(tasks())
+            if taskdata is None:
+                raise BugtrackerError, "Bug #%d on %s has no tasks (%s/bugs/%d)" % (id, self.description, self.url, id)
+
+            assignee = ''
+            if taskdata.assignee_link: # "Display Name (Launchpad ID)"
+                person = get(taskdata.assignee_link)
+                assignee = u"%s (%s)" % (person.display_name, person.name)
+        except utils.web.Error, e:
+            raise BugtrackerError, "Could not gather data from %s for bug #%s (%s/bugs/%s): %s" % (self.description, id, self.url, id, e)
+        finally:
+            stats.inc('bugtracker_launchpad_requests_total', requests[0], tracker=self.name)
+            supylog.debug("Bugtracker: %s bug #%d took %d requests" % (self.description, id, requests[0]))
+
+        # Not every bug has the counts, LPEntry returns None for those
+        extinfo = "(affected: %d, heat: %d)" % (bugdata.users_affected_count_with_dupes or 0, bugdata.heat or 0)
+
+        return [(bugdata.id, taskdata.bug_target_display_name, summary_prefix + bugdata.title, taskdata.importance,
+                 taskdata.status, assignee, "%s/bugs/%s" % (self.url, bugdata.id), extinfo)]
 
     @classmethod
     def _old_sort(cls, task1, task2): #Depricated
@@ -767,7 +1963,7 @@ class Launchpad(IBugtracker):
 
     def get_bug_new(self, id): #TODO: Rename this method to 'get_bug'
         try:
-            bugdata = self.lp.bugs[id]
+            bugdata = self.get_lp().bugs[id]
             if bugdata.private:
                 raise BugtrackerError, "This bug is private"
             dup = bugdata.duplicate_of
@@ -782,23 +1978,7 @@ class Launchpad(IBugtracker):
             tasks = bugdata.bug_tasks
 
             if tasks.total_size != 1:
-                tasks = list(tasks)
-                try:
-                    tasks.sort(self._sort)
-                    taskdata = tasks[-1]
-                except ValueError:
-                    tasks = [_ for _ in tasks if _.bug_target_name.endswith(u'(Ubuntu)')]
-                    if tasks:
-                        if len(tasks) != 1:
-                            try:
-                                tasks.sort(self._sort)
-                                taskdata = tasks[-1]
-                            except ValueError:
-                                taskdata = bugdata.bug_tasks[bugdata.bug_tasks.total_size - 1]
-                        else:
-                            taskdata = tasks[-1]
-                    else:
-                        taskdata = tasks[-1]
+                taskdata = self._choose_task(tasks)
             else:
                 taskdata = tasks[0]
 
@@ -835,7 +2015,7 @@ class Launchpad(IBugtracker):
             raise BugtrackerError, "https://bugs.launchpad.net/ubuntu/+bug/1 (Not reporting large bug)"
 
         try:
-            bugdata = utils.web.getUrl("%s/bugs/%d/+text" % (self.url,id))
+            bugdata = self.get_url("%s/bugs/%d/+text" % (self.url,id))
         except Exception, e:
             if '404' in str(e):
                 raise BugNotFoundError
@@ -850,6 +2030,7 @@ class Launchpad(IBugtracker):
             data     =  bugdata.split('\n\n')
             bugdata  = data[0]
             taskdata = data[1:]
+            import email.FeedParser
             parser   = email.FeedParser.FeedParser()
             parser.feed(bugdata)
             bugdata = parser.close()
@@ -888,21 +2069,44 @@ class Launchpad(IBugtracker):
 # Fortunately bugs.donarmstrong.com has a SOAP interface which we can use.
 # </rant>
 class Debbugs(IBugtracker):
+    batched = True # The SOAP get_status call takes a list of bugs
+
     def __init__(self, *args, **kwargs):
         IBugtracker.__init__(self, *args, **kwargs)
-        self.soap_proxy = SOAPpy.SOAPProxy("bugs.debian.org/cgi-bin/soap.cgi", "Debbugs/SOAP/Status")
-        self.soap_proxy.soapaction = "Debbugs/SOAP/Status#get_status"
+        self.get_status = soap.Method(self.url + "/cgi-bin/soap.cgi", "Debbugs/SOAP/Status", "get_status", ('bugs',),
+                                      keep=('item', 'key', 'value', 'package', 'subject', 'severity', 'fixed_versions'),
+                                      tracker=self.name)
 
     def get_bug(self, id):
-        bug_url = "http://bugs.debian.org/cgi-bin/bugreport.cgi?bug=%d" % id
+        result = self.get_bugs([id])[id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_bugs(self, ids):
         try:
-            raw = self.soap_proxy.get_status(id)
+            raw = self.get_status.call(self.soap_post, ids) # get_status takes a list of bugs
         except Exception, e:
             s = 'Could not parse data returned by %s: %s' % (self.description, e)
             raise BugtrackerError, s
-        if not raw:
-            raise BugNotFoundError
-        raw = raw['item']['value']
+        results = {}
+        if raw:
+            items = raw['item']
+            if not isinstance(items, (list, tuple)): # Only one bug found
+                items = [items]
+            for item in items:
+                try:
+                    id = int(item['key'])
+                except Exception:
+                    continue
+                results[id] = self._parse_status(id, item['value'])
+        for id in ids:
+            if id not in results:
+                results[id] = BugNotFoundError()
+        return results
+
+    def _parse_status(self, id, raw):
+        bug_url = "http://bugs.debian.org/cgi-bin/bugreport.cgi?bug=%d" % id
         try:
             if len(raw['fixed_versions']):
                 status = 'Fixed'
@@ -911,18 +2115,24 @@ class Debbugs(IBugtracker):
             return [(id, raw['package'], raw['subject'], raw['severity'], status, '', "%s/%s" % (self.url, id))]
         except Exception, e:
             s = 'Could not parse data returned by %s bugtracker: %s (%s)' % (self.description, e, bug_url)
-            raise BugtrackerError, s
+            return BugtrackerError(s)
 
 class Mantis(IBugtracker):
     def __init__(self, *args, **kwargs):
         IBugtracker.__init__(self, *args, **kwargs)
-        self.soap_proxy = SOAPpy.SOAPProxy(self.url + "/api/soap/mantisconnect.php", "http://futureware.biz/mantisconnect")
-        self.soap_proxy.soapaction = "http://futureware.biz/mantisconnect#mc_issue_get"
+        self.mc_issue_get = soap.Method(self.url + "/api/soap/mantisconnect.php", "http://futureware.biz/mantisconnect",
+                                        "mc_issue_get", ('username', 'password', 'issue_id'),
+                                        keep=('project', 'name', 'summary', 'priority', 'resolution'), tracker=self.name)
 
     def get_bug(self, id):
         url = self.url + "/view.php?id=%i" % id
         try:
-            raw = self.soap_proxy.mc_issue_get('', "", id)
+            raw = self.mc_issue_get.call(self.soap_post, '', "", id)
+        except soap.Fault, e:
+            if 'not found' in e.string.lower(): # "Issue #123 not found."
+                raise BugNotFoundError
+            s = 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
+            raise BugtrackerError, s
         except Exception, e:
             s = 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
             raise BugtrackerError, s
@@ -939,123 +2149,258 @@ class Mantis(IBugtracker):
 # has commas, things get tricky.
 # This should be more robust than the screen-scraping done previously.
 class Trac(IBugtracker):
+    batched = True # The query module returns several tickets at once
+    columns = ('id', 'summary', 'status', 'component', 'severity', 'priority', 'owner')
+
+    def is_outage(self, e):
+        # A ticket that doesn't exist is a 500 on its own page, see get_bug
+        if isinstance(e, transport.HTTPError) and e.status == 500 and e.url \
+           and e.url.startswith(self.url + '/') and e.url.endswith('?format=tab'):
+            return False
+        return IBugtracker.is_outage(self, e)
+
     def get_bug(self, id): # This is still a little rough, but it works :)
         bug_url = "%s/%d" % (self.url, id)
         try:
-            raw = utils.web.getUrl("%s?format=tab" % bug_url)
+            raw = self.get_url("%s?format=tab" % bug_url)
         except Exception, e:
             if 'HTTP Error 500' in str(e):
                 raise BugNotFoundError
-            s = 'Could not parse data returned by %s: %s' % (self.description, e, bug_url)
+            s = 'Could not parse data returned by %s: %s (%s)' % (self.description, e, bug_url)
             raise BugtrackerError, s
-        raw = raw.replace("\r\n", '\n')
-        (headers, rest) = raw.split('\n', 1)
-        headers = headers.strip().split('\t')
-        rest = rest.strip().split('\t')
-        title = status = package = severity = assignee = "Unknown"
-        if "summary" in headers:
-            title = rest[headers.index("summary")]
-        if "status" in headers:
-            status = rest[headers.index("status")]
-        if "component" in headers:
-            package = rest[headers.index("component")]
-        if "severity" in headers:
-            severity = rest[headers.index("severity")]
-        if "owner" in headers:
-            assingee = rest[headers.index("owner")]
-        if severity == "Unknown" and "priority" in headers:
-            severity = rest[headers.index("priority")]
-
-        return [(id, package, title, severity, status, assignee, bug_url)]
-        
+        for (bug_id, report) in self._parse(raw, id):
+            return report
+        raise BugNotFoundError
+
+    def get_bugs(self, ids):
+        if len(ids) == 1:
+            return IBugtracker.get_bugs(self, ids)
+        base = self.url
+        if base.endswith('/ticket'):
+            base = base[:-len('/ticket')]
+        url = "%s/query?id=%s&format=tab&order=id&%s" % (base, '|'.join([str(id) for id in ids]),
+                                                         '&'.join(['col=%s' % col for col in self.columns]))
+        try:
+            raw = self.get_url(url)
+        except transport.HTTPError, e:
+            if e.status < 500: # No query module, or we may not use it
+                return IBugtracker.get_bugs(self, ids)
+            raise BugtrackerError, 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
+        except Exception, e:
+            raise BugtrackerError, 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
+        results = {}
+        for (id, report) in self._parse(raw):
+            if id in ids:
+                results[id] = report
+        return results
+
+    def _parse(self, raw, id=None):
+        """Yields (id, report) for every row of a format=tab export. Without
+        an id column, the rows are taken to be ticket <id>"""
+        if raw.startswith(codecs.BOM_UTF8):
+            raw = raw[len(codecs.BOM_UTF8):]
+        rows = csv.reader(StringIO(raw), delimiter='\t')
+        try:
+            headers = rows.next()
+        except StopIteration:
+            return
+        # Which column has which field, worked out once for all rows
+        cols = dict([(name.strip().lower(), i) for (i, name) in enumerate(headers)])
+        def field(row, name):
+            i = cols.get(name)
+            if i is None or i >= len(row):
+                return None
+            return row[i]
+        for row in rows:
+            if not row:
+                continue
+            bug_id = field(row, 'id')
+            try:
+                bug_id = int(bug_id.lstrip('#'))
+            except (AttributeError, ValueError):
+                if id is None:
+                    continue
+                bug_id = id
+            title = field(row, 'summary') or "Unknown"
+            status = field(row, 'status') or "Unknown"
+            package = field(row, 'component') or "Unknown"
+            severity = field(row, 'severity') or field(row, 'priority') or "Unknown"
+            assignee = field(row, 'owner')
+            if assignee is None:
+                assignee = "Unknown"
+            yield (bug_id, [(bug_id, package, title, severity, status, assignee, "%s/%d" % (self.url, bug_id))])
+
+tag_re = re.compile(r'<[^<>]*>') # Not <[^>]*>, which is quadratic on a run of unclosed '<'
+
+def strip_tags(s):
+    return tag_re.sub('', s)
+
+def html_fields(*fields):
+    """(name, regexp) pairs for PageScraper, compiled once. Group 1 of the
+    regexp is the value. Keep the quantifiers bounded ({0,200}? rather than
+    *?) so a match never needs more than PageScraper.window bytes"""
+    return tuple([(name, re.compile(regexp, re.I | re.S)) for (name, regexp) in fields])
+
+class PageScraper:
+    """Incremental field extractor for HTML pages. The page is read in chunks
+    and the fields are searched for in a sliding window of the last window
+    bytes plus the new chunk, so the work is linear in the size of the page.
+    Reading stops as soon as all fields are found, and with an exception when
+    the page is larger than max_bytes or takes longer than max_time seconds.
+
+    In ordered mode each field is only searched for after the previous one,
+    like a single regexp with all fields would, but without its backtracking."""
+    window    = 4096
+    max_bytes = 1048576
+    max_time  = 10
+
+    @classmethod
+    def configure(cls, **kwargs):
+        for (k, v) in kwargs.items():
+            setattr(cls, k, v)
+
+    def __init__(self, fields, ordered=False):
+        self.fields  = fields
+        self.ordered = ordered
+        self.found   = {} # name -> value, tags stripped and entities decoded
+        self.buffer  = ''
+        self.nbytes  = 0
+
+    def done(self):
+        return len(self.found) == len(self.fields)
+
+    def _value(self, raw):
+        try:
+            raw = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            raw = raw.decode('iso-8859-1')
+        return _decode_entities(strip_tags(raw)).strip()
+
+    def _search(self, final):
+        """Search the buffer, a match that runs up to the end of the buffer
+        may be cut short by the chunk boundary, so it is only taken if final"""
+        buf = self.buffer
+        pos = 0
+        for (name, regexp) in self.fields:
+            if name in self.found:
+                continue
+            m = regexp.search(buf, pos)
+            if m and (final or m.end() < len(buf)):
+                self.found[name] = self._value(m.group(1))
+                if self.ordered:
+                    pos = m.end()
+                    continue
+            if self.ordered:
+                break
+        if self.ordered:
+            # Fields already found can't be searched for again, skip past them
+            pos = max(pos, len(buf) - self.window)
+        else:
+            pos = len(buf) - self.window
+        self.buffer = buf[max(0, pos):]
+
+    def feed(self, data, final=False):
+        """Feed a chunk of the page, returns True when no more is needed"""
+        self.nbytes += len(data)
+        self.buffer += data
+        self._search(final)
+        return self.done()
+
+    def parse(self, fd, chunksize=8192):
+        """Read fields from fd, returns {name: value} of the ones found. Once
+        they are, fd is closed, which reads the rest of a small page so its
+        connection can be reused (see transport.Response.close)"""
+        started = time.time()
+        try:
+            while not self.done():
+                data = fd.read(chunksize)
+                if not data:
+                    self.feed('', True)
+                    break
+                if self.feed(data):
+                    break
+                if self.max_bytes and self.nbytes > self.max_bytes:
+                    raise BugtrackerError, "Page is larger than %d bytes" % self.max_bytes
+                if self.max_time and time.time() - started > self.max_time:
+                    raise BugtrackerError, "Page took longer than %d seconds" % self.max_time
+        except:
+            # Don't read any more of a page that blew its budget
+            getattr(fd, 'abort', fd.close)()
+            raise
+        fd.close()
+        return self.found
+
 class WikiForms(IBugtracker):
-    def get_bug(self, id):
-        def strip_tags(s):
-            while '<' in s and '>' in s:
-                s = str(s[:s.find('<')]) + str(s[s.find('>')+1:])
-            return s
+    fields = html_fields(
+        ('title',    r'<dt>\s*summary\s*</dt>\s*<dd>(.{0,1000}?)</dd>'),
+        ('severity', r'<dt>\s*importance\s*</dt>\s*<dd>(.{0,500}?)</dd>'),
+        ('status',   r'<dt>\s*status\s*</dt>\s*<dd>(.{0,500}?)</dd>'),
+        ('package',  r'<dt>\s*category\s*</dt>\s*<dd>(.{0,500}?)</dd>'),
+    )
 
+    def get_bug(self, id):
         url = "%s/%05d" % (self.url, id)
         try:
-            bugdata = utils.web.getUrl(url)
+            bug = PageScraper(self.fields).parse(self.open_url(url))
         except Exception, e:
             if 'HTTP Error 404' in str(e):
                 raise BugNotFoundError
             s = 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
             raise BugtrackerError, s
-        for l in bugdata.split("\n"):
-            l2 = l.lower()
-            if '<dt>importance</dt>' in l2:
-                severity = 'Importance ' + strip_tags(l[l.find('<dd>')+4:])
-            if '<dt>summary</dt>' in l2:
-                title = strip_tags(l[l.find('<dd>')+4:])
-            if '<dt>status</dt>' in l2:
-                status = strip_tags(l[l.find('<dd>')+4:])
-            if '<dt>category</dt>' in l2:
-                package = strip_tags(l[l.find('<dd>')+4:])
-        return [(id, package, title, severity, status, '', "%s/%05d" % (self.url, id))]
+        if not bug:
+            raise BugNotFoundError
+        return [(id, bug.get('package', ''), bug.get('title', 'Unknown'), 'Importance ' + bug.get('severity', 'Unknown'),
+                 bug.get('status', 'Unknown'), '', url)]
 
 class Str(IBugtracker):
+    fields = html_fields(
+        ('package',  r'>\s*application:\s*</th>\s*<td>(.{0,500}?)</td>'),
+        ('status',   r'nowrap>\s*status:\s*</th>\s*<td>(?:[^<-]{0,20} - )?(.{0,500}?)</td>'),
+        ('severity', r'nowrap>\s*priority:\s*</th>\s*<td>(?:[^<-]{0,20} - )?([^,<]{0,500})'),
+        ('title',    r'nowrap>\s*summary:\s*</th>\s*<td>(.{0,1000}?)</td>'),
+        ('assignee', r'nowrap>\s*assigned to:\s*</th>\s*<td>(.{0,500}?)</td>'),
+    )
+
     def get_bug(self, id):
-        def strip_tags(s):
-            while '<' in s and '>' in s:
-                s = str(s[:s.find('<')]) + str(s[s.find('>')+1:])
-            return s
         url = "%s?L%d" % (self.url, id)
         try:
-            bugdata = utils.web.getUrl(url)
+            bug = PageScraper(self.fields).parse(self.open_url(url))
         except Exception, e:
             s = 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
             raise BugtrackerError, s
-        for l in bugdata.split("\n"):
-            l2 = l.lower()
-            if 'nowrap>priority:</th>' in l2:
-                severity = 'Priority ' + l[l.find(' - ')+3:min(l.find(','),l.find('</td>'))]
-            if '>application:</th>' in l2:
-                package = l[l.find('<td>')+4:l.find('</td>')]
-            if 'nowrap>status:</th>' in l2:
-                status = l[l.find(' - ')+3:l.find('</td>')]
-            if 'nowrap>summary:</th>' in l2:
-                title = l[l.find('<td>')+4:l.find('</td>')]
-            if 'nowrap>assigned to:</th>' in l2:
-                assignee = strip_tags(l[l.find('<td>')+4:l.find('</td>')])
-                if assignee == 'Unassigned':
-                    assignee = 'nobody'
-        return [(id, package, title, severity, status, assignee, "%s?L%d" % (self.url, id))]
-        
-
-sfre = re.compile(r"""
-                  .*?
-                  <h2>\[.*?\]\s*(?P<title>.*?)</h2>
-                  .*?
-                  assigned.*?<br>\s+(?P<assignee>\S+)
-                  .*?
-                  priority.*?(?P<priority>\d+)
-                  .*?
-                  status.*?<br>\s+(?P<status>\S+)
-                  .*?
-                  resolution.*?<br>\s+(?P<resolution>\S+)
-                  .*?
-                  """, re.VERBOSE | re.DOTALL | re.I)
+        if not bug:
+            raise BugNotFoundError
+        assignee = bug.get('assignee', '')
+        if assignee == 'Unassigned':
+            assignee = 'nobody'
+        return [(id, bug.get('package', ''), bug.get('title', 'Unknown'), 'Priority ' + bug.get('severity', 'Unknown'),
+                 bug.get('status', 'Unknown'), assignee, url)]
+
 #NOTE: Until sf.net has a way to export formatted bug data, this will remain broken and unmaintained
 class Sourceforge(IBugtracker):
     _sf_url = 'http://sf.net/support/tracker.php?aid=%d'
+    # In the order they appear on the page
+    fields = html_fields(
+        ('title',      r'<h2>\[[^\]<]{0,100}\]\s*(.{0,1000}?)</h2>'),
+        ('assignee',   r'assigned.{0,1000}?<br>\s+(\S{1,200})'),
+        ('priority',   r'priority.{0,1000}?(\d+)'),
+        ('status',     r'status.{0,1000}?<br>\s+(\S{1,200})'),
+        ('resolution', r'resolution.{0,1000}?<br>\s+(\S{1,200})'),
+    )
+
     def get_bug(self, id):
         url = self._sf_url % id
         try:
-            bugdata = utils.web.getUrl(url)
+            bug = PageScraper(self.fields, ordered=True).parse(self.open_url(url))
         except Exception, e:
             s = 'Could not parse data returned by %s: %s (%s)' % (self.description, e, url)
             raise BugtrackerError, s
-        try:
-            reo = sfre.search(bugdata)
-            status = reo.group('status')
-            resolution = reo.group('resolution')
-            if not (resolution.lower() == 'none'):
-                status += ' ' + resolution
-            return [(id, None, reo.group('title'), "Pri: %s" % reo.group('priority'), status, reo.group('assignee'),self._sf_url % id)]
-        except:
+        if len(bug) < len(self.fields):
             raise BugNotFoundError
+        status = bug['status']
+        if not (bug['resolution'].lower() == 'none'):
+            status += ' ' + bug['resolution']
+        return [(id, None, bug['title'], "Pri: %s" % bug['priority'], status, bug['assignee'], url)]
 
 # Introspection is quite cool
 defined_bugtrackers = {}
@@ -1087,3 +2432,4 @@ registerBugtracker('ubottu', 'https://launchpad.net', 'Ubottu', 'launchpad')
 # Don't delete this one
 registerBugtracker('sourceforge', 'http://sourceforge.net/tracker/', 'Sourceforge', 'sourceforge')
 Class = Bugtracker
+import_time = time.time() - import_started
@@ -0,0 +1,208 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Just enough SOAP 1.1 for the Debbugs and Mantis drivers. The envelope of a
+method is built once and only the arguments are filled in per call, requests
+go over the keep-alive connections of transport.pool, and responses are
+decoded with expat into plain dicts, lists and strings, keeping only the
+elements the driver reads.
+
+Decoded values look like SOAPpy's: structs are dicts, arrays are lists, an
+element that occurs more than once in a struct becomes a list and everything
+else is a unicode string (None for xsi:nil). base64 encoded strings, which
+SOAP::Lite sends for anything that isn't ASCII, are decoded as UTF-8.
+"""
+
+import time, binascii
+import xml.parsers.expat as expat
+from xml.sax.saxutils import escape
+import supybot.utils as utils
+import transport
+from metrics import stats
+
+stats.describe('bugtracker_soap_seconds', 'Time spent per phase of a SOAP call')
+
+class Fault(Exception):
+    """A SOAP fault returned by the server"""
+    def __init__(self, code, string):
+        Exception.__init__(self, string)
+        self.code   = code
+        self.string = string
+
+def post(url, body, headers=None, timeout=None):
+    """transport.pool.post, except that a fault sent with a 500 status is
+    returned like any other response: the server is fine, the call failed"""
+    try:
+        return transport.pool.post(url, body, headers, timeout)
+    except transport.HTTPError, e:
+        if e.status == 500 and 'Fault' in e.body:
+            return e.body
+        raise
+
+def encode(name, value):
+    """One argument as an element called name"""
+    if isinstance(value, bool):
+        return '<%s xsi:type="xsd:boolean">%d</%s>' % (name, value, name)
+    if isinstance(value, (int, long)):
+        return '<%s xsi:type="xsd:int">%d</%s>' % (name, value, name)
+    if isinstance(value, (list, tuple)):
+        types = set([isinstance(v, (int, long)) and 'xsd:int' or 'xsd:string' for v in value])
+        itemtype = len(types) == 1 and types.pop() or 'xsd:anyType'
+        return '<%s SOAP-ENC:arrayType="%s[%d]" xsi:type="SOAP-ENC:Array">%s</%s>' % (
+                name, itemtype, len(value), ''.join([encode('item', v) for v in value]), name)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return '<%s xsi:type="xsd:string">%s</%s>' % (name, escape(str(value)), name)
+
+class Method:
+    """A remote method: Method(endpoint, namespace, 'get_status', ('bugs',),
+    keep=('item', 'key', ...)).call(send, [1, 2, 3]) returns the decoded
+    result. keep names the elements to decode below the result, everything
+    else is skipped along with its children"""
+    def __init__(self, endpoint, namespace, name, params, keep, soapaction=None, tracker=''):
+        self.endpoint = endpoint
+        self.name     = name
+        self.params   = params
+        self.keep     = frozenset(keep)
+        self.tracker  = tracker # Label of the timings
+        self.head = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<SOAP-ENV:Envelope SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"'
+                     ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"'
+                     ' xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/"'
+                     ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                     ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+                     '<SOAP-ENV:Body><ns1:%s xmlns:ns1="%s">' % (name, escape(namespace, {'"': '&quot;'})))
+        self.tail = '</ns1:%s></SOAP-ENV:Body></SOAP-ENV:Envelope>' % name
+        self.headers = {
+            'Content-Type': 'text/xml; charset="utf-8"',
+            'SOAPAction':   '"%s"' % (soapaction or "%s#%s" % (namespace, name)),
+        }
+
+    def call(self, send, *args):
+        """Call the method with send(url, body, headers), which returns the
+        response body. Raises Fault if the server returns one"""
+        started = time.time()
+        body = self.head + ''.join([encode(name, arg) for (name, arg) in zip(self.params, args)]) + self.tail
+        sending = time.time()
+        response = send(self.endpoint, body, self.headers)
+        decoding = time.time()
+        try:
+            return Decoder(self.keep).decode(response)
+        finally:
+            done = time.time()
+            for (phase, elapsed) in (('encode', sending - started), ('network', decoding - sending),
+                                     ('decode', done - decoding)):
+                stats.observe('bugtracker_soap_seconds', elapsed, phase=phase, method=self.name, tracker=self.tracker)
+
+def local(name):
+    return name[name.find(':') + 1:]
+
+class Decoder:
+    """Decodes the first result of a response. Depth 1 is the Envelope, 2 the
+    Body, 3 the response (or Fault) and 4 the results"""
+    def __init__(self, keep):
+        self.keep     = keep
+        self.depth    = 0
+        self.skipping = 0  # Depth of the element being skipped, 0 if none
+        self.stack    = [] # [name, is array, is base64, children, text] per decoded element
+        self.results  = []
+        self.fault    = None
+
+    def decode(self, data):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler  = self.start
+        parser.EndElementHandler    = self.end
+        parser.CharacterDataHandler = self.text
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError, e:
+            raise utils.web.Error, "Invalid SOAP response: %s" % e
+        if self.fault is not None:
+            raise Fault(self.fault.get('faultcode', ''), self.fault.get('faultstring', ''))
+        return self.results and self.results[0] or None
+
+    def start(self, name, attrs):
+        self.depth += 1
+        if self.skipping:
+            return
+        name = local(name)
+        if self.depth == 3 and name == 'Fault':
+            self.fault = {}
+        if self.depth < 4 or (self.depth > 4 and name not in self.keep) or (self.depth == 4 and self.fault is not None
+                                                                             and name not in ('faultcode', 'faultstring')):
+            if self.depth >= 4:
+                self.skipping = self.depth
+            return
+        array = base64 = nil = False
+        for (attr, value) in attrs.iteritems():
+            attr = local(attr)
+            if attr == 'arrayType' or (attr == 'type' and local(value) == 'Array'):
+                array = True
+            elif attr == 'type' and local(value) in ('base64Binary', 'base64'):
+                base64 = True
+            elif attr == 'nil' and value in ('true', '1'):
+                nil = True
+        if array:
+            children = []
+        else:
+            children = {}
+        if nil:
+            text = None
+        else:
+            text = []
+        self.stack.append([name, array, base64, children, text])
+
+    def end(self, name):
+        depth = self.depth
+        self.depth -= 1
+        if self.skipping:
+            if self.skipping == depth:
+                self.skipping = 0
+            return
+        if depth < 4:
+            return
+        (name, array, base64, children, text) = self.stack.pop()
+        if array or children:
+            value = children
+        elif text is None:
+            value = None
+        else:
+            value = u''.join(text)
+            if base64:
+                try:
+                    value = value.encode('ascii').decode('base64').decode('utf-8', 'replace')
+                except (UnicodeError, binascii.Error):
+                    pass # Not base64 after all, keep the text
+        if depth == 4:
+            if self.fault is not None:
+                self.fault[name] = value
+            else:
+                self.results.append(value)
+            return
+        (parent_array, siblings) = (self.stack[-1][1], self.stack[-1][3])
+        if parent_array:
+            siblings.append(value)
+        elif name in siblings:
+            if not isinstance(siblings[name], list):
+                siblings[name] = [siblings[name]]
+            siblings[name].append(value)
+        else:
+            siblings[name] = value
+
+    def text(self, data):
+        if not self.skipping and self.depth >= 4 and self.stack and self.stack[-1][4] is not None:
+            self.stack[-1][4].append(data)
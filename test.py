@@ -15,3 +15,6 @@
 from supybot.test import *
 class BugtrackerTestCase(PluginTestCase):
     plugins = ('Bugtracker',)
+
+# Offline tests of the data structures and parsers, see test_units.py
+from test_units import *
@@ -0,0 +1,721 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+Offline unit tests for the plugin's data structures and parsers. They need
+supybot to be importable, but no bot and no network: responses come from
+benchmarks/fixtures. test.py pulls them in for supybot-test, they can also be
+run on their own with python test_units.py
+"""
+
+import os, sys, time, json, shutil, tempfile, threading, unittest
+from cStringIO import StringIO
+
+plugin_dir = os.path.dirname(os.path.abspath(__file__))
+fixture_dir = os.path.join(plugin_dir, 'benchmarks', 'fixtures')
+if __name__ == '__main__':
+    sys.path.insert(0, plugin_dir)
+
+import config
+import plugin
+import soap
+import cveindex
+import transport
+
+__all__ = ['BugCacheTestCase', 'FetchPoolTestCase', 'GetBugsTestCase', 'RepeatGuardTestCase',
+           'TrackerIndexTestCase', 'MakeCleanTestCase', 'ConnectionPoolTestCase', 'ZillaParserTestCase',
+           'PageScraperTestCase', 'SOAPDecoderTestCase', 'CVEIndexTestCase', 'DuplicateMapTestCase',
+           'ChooseTaskTestCase', 'LaunchpadJSONTestCase']
+
+def fixture(name):
+    fd = open(os.path.join(fixture_dir, name), 'rb')
+    try:
+        return fd.read()
+    finally:
+        fd.close()
+
+def repeat_bugs(template, ids, missing=''):
+    """The part of template between <!-- bug --> and <!-- /bug --> once per
+    id, bug 404 gets <missing> instead (like benchmarks/server.py)"""
+    start = template.index('<!-- bug -->')
+    end = template.index('<!-- /bug -->') + len('<!-- /bug -->')
+    bug = template[start:end]
+    bugs = []
+    for id in ids:
+        if id == 404:
+            bugs.append(missing)
+        else:
+            bugs.append(bug.replace('@ID@', str(id)))
+    return template[:start] + ''.join(bugs) + template[end:]
+
+class CountingFile:
+    """File-like object that remembers how much was read from it"""
+    def __init__(self, data):
+        self.fd = StringIO(data)
+        self.nread = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        data = self.fd.read(size)
+        self.nread += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+
+class FakeTracker(plugin.IBugtracker):
+    """Returns a report for every id, after delays[id] seconds. Bug 404 doesn't
+    exist. Calls are counted and can be held back with the gate event"""
+    def __init__(self, delays=None):
+        plugin.IBugtracker.__init__(self, 'fake', 'http://fake.example.org/%f' % time.time(), 'Fake')
+        self.delays = delays or {}
+        self.calls  = []
+        self.gate   = threading.Event()
+        self.gate.set()
+        self.lock   = threading.Lock()
+
+    def get_bug(self, id):
+        self.lock.acquire()
+        try:
+            self.calls.append(id)
+        finally:
+            self.lock.release()
+        self.gate.wait(5)
+        time.sleep(self.delays.get(id, 0))
+        if id == 404:
+            raise plugin.BugNotFoundError
+        return [(id, 'package', 'Bug %d' % id, 'high', 'open', '', 'http://fake.example.org/%d' % id)]
+
+class FakeBugtracker:
+    """Just enough of the Bugtracker plugin to run its get_bugs"""
+    get_bugs = plugin.Bugtracker.get_bugs.im_func
+
+    def __init__(self, pool):
+        self.cache = plugin.BugCache(100, 1048576, 300, 60)
+        self.pool  = pool
+
+    def is_ok(self, channel, tracker, id):
+        return True
+
+    def format_reports(self, channel, tracker, bugs, do_assignee, do_url=True, show_tracker=True):
+        return [r[2] for r in bugs]
+
+def stop_pool(pool):
+    """Stop pool and wait for its workers, so none outlives the test"""
+    pool.stop()
+    for thread in pool.threads:
+        thread.join(5)
+
+def wait_for(event, what):
+    if not event.wait(5):
+        raise AssertionError("Timed out waiting for %s" % what)
+
+class BugCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracker = FakeTracker()
+        self.cache = plugin.BugCache(3, 1048576, 300, 60)
+
+    def testClaimCoalesces(self):
+        arrived = []
+        self.assertEqual(self.cache.claim(self.tracker, [1, 2], None), [1, 2])
+        self.assertEqual(self.cache.claim(self.tracker, [2, 3], lambda id, result: arrived.append((id, result))), [3])
+        fetched = self.cache.fill(self.tracker, [1, 2], {1: ['one'], 2: ['two']})
+        self.assertEqual(fetched, {1: ['one'], 2: ['two']})
+        self.assertEqual(arrived, [(2, ['two'])])
+        self.assertEqual(self.cache.coalesced, 1)
+        # Filled in bugs are no longer in flight
+        self.assertEqual(self.cache.claim(self.tracker, [2], None), [2])
+
+    def testFillMissingIsNotFound(self):
+        self.cache.claim(self.tracker, [1, 404], None)
+        fetched = self.cache.fill(self.tracker, [1, 404], {1: ['one']})
+        self.failUnless(isinstance(fetched[404], plugin.BugNotFoundError))
+        (results, misses) = self.cache.lookup_many(self.tracker, [1, 404, 5])
+        self.assertEqual(misses, [5])
+        self.assertEqual(results[1], (True, ['one']))
+        self.failIf(results[404][0])
+
+    def testUncacheableErrors(self):
+        self.cache.claim(self.tracker, [1], None)
+        self.cache.fill(self.tracker, [1], {1: plugin.BugtrackerError("Connection refused")})
+        self.assertEqual(self.cache.lookup_many(self.tracker, [1])[1], [1])
+
+    def testLRU(self):
+        for id in (1, 2, 3):
+            self.cache.store(self.tracker, id, ['r%d' % id])
+        self.cache.lookup(self.tracker, 1)
+        self.cache.store(self.tracker, 4, ['r4'])
+        (results, misses) = self.cache.lookup_many(self.tracker, [1, 2, 3, 4])
+        self.assertEqual(misses, [2])
+        self.assertEqual(self.cache.evictions, 1)
+
+    def testNegativeTTL(self):
+        cache = plugin.BugCache(10, 1048576, 300, 0.05)
+        cache.store(self.tracker, 404, error=plugin.BugNotFoundError())
+        cache.store(self.tracker, 1, ['one'])
+        (found, reports, error, stale) = cache.lookup(self.tracker, 404)
+        self.failUnless(found and isinstance(error, plugin.BugNotFoundError))
+        self.assertEqual(cache.negative_hits, 1)
+        time.sleep(0.1)
+        self.failIf(cache.lookup(self.tracker, 404)[0])
+        self.assertEqual(cache.lookup(self.tracker, 1)[:2], (True, ['one']))
+
+    def testStale(self):
+        cache = plugin.BugCache(10, 1048576, 0.05, 60, 60)
+        cache.store(self.tracker, 1, ['old'])
+        time.sleep(0.1)
+        refreshed = []
+        def background(key, fetch, args, callback):
+            refreshed.append(args)
+            callback((True, fetch(*args)))
+        (results, misses) = cache.lookup_many(self.tracker, [1], lambda id: ['new'], background)
+        self.assertEqual(results[1], (True, ['old']))
+        self.assertEqual(refreshed, [(1,)])
+        self.assertEqual(cache.stale_hits, 1)
+        self.assertEqual(cache.lookup(self.tracker, 1)[:2], (True, ['new']))
+
+class FetchPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = plugin.FetchPool(4, 2)
+
+    def tearDown(self):
+        stop_pool(self.pool)
+
+    def testMapAsyncKeepsOrder(self):
+        done = threading.Event()
+        got = []
+        def callback(results):
+            got.extend(results)
+            done.set()
+        delays = {1: 0.1, 2: 0.05, 3: 0.0, 4: 0.02}
+        def work(id):
+            time.sleep(delays[id])
+            if id == 3:
+                raise ValueError(id)
+            return id * 10
+        self.pool.map_async('key', work, [1, 2, 3, 4], callback)
+        wait_for(done, 'map_async')
+        self.assertEqual([r[0] for r in got], [True, True, False, True])
+        self.assertEqual([r[1] for r in got if r[0]], [10, 20, 40])
+
+    def testPerKeyLimit(self):
+        running = [0, 0] # now, most at once
+        lock = threading.Lock()
+        def work(id):
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            time.sleep(0.02)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+        done = threading.Event()
+        self.pool.map_async('slow tracker', work, range(8), lambda results: done.set())
+        wait_for(done, 'map_async')
+        self.assertEqual(running[1], 2)
+
+    def testMaxPending(self):
+        pool = plugin.FetchPool(1, 1, 2)
+        gate = threading.Event()
+        try:
+            pool.submit('key', gate.wait, (5,), lambda result: None)
+            time.sleep(0.05) # Let the worker pick it up
+            pool.submit('key', lambda: None, (), lambda result: None)
+            pool.submit('key', lambda: None, (), lambda result: None)
+            self.assertRaises(plugin.BugtrackerError, pool.submit, 'key', lambda: None, (), lambda result: None)
+        finally:
+            gate.set()
+            stop_pool(pool)
+        self.assertRaises(plugin.BugtrackerError, pool.submit, 'key', lambda: None, (), lambda result: None)
+
+    def testErrorKeepsTraceback(self):
+        done = threading.Event()
+        got = []
+        def fails():
+            {}['no such key']
+        def callback(result):
+            got.append(result)
+            done.set()
+        self.pool.submit('key', fails, (), callback)
+        wait_for(done, 'submit')
+        (ok, e) = got[0]
+        self.failIf(ok)
+        self.failUnless('in fails' in e.traceback and 'KeyError' in e.traceback, e.traceback)
+        logged = []
+        error = plugin.supylog.error
+        plugin.supylog.error = lambda msg, *args: logged.append(msg)
+        try:
+            plugin.log_error("Lookup failed", e)
+        finally:
+            plugin.supylog.error = error
+        self.failUnless(logged[0].startswith('Lookup failed\nTraceback') and 'in fails' in logged[0], logged)
+
+class GetBugsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = plugin.FetchPool(4, 4)
+        self.bot = FakeBugtracker(self.pool)
+
+    def tearDown(self):
+        stop_pool(self.pool)
+
+    def lookup(self, tracker, ids):
+        done = threading.Event()
+        got = []
+        def callback(results):
+            got.extend(results)
+            done.set()
+        self.bot.get_bugs('#test', tracker, ids, False, callback)
+        return (done, got)
+
+    def testFanOutKeepsOrder(self):
+        tracker = FakeTracker({1: 0.1, 2: 0.05, 3: 0.0})
+        (done, got) = self.lookup(tracker, [1, 2, 404, 3])
+        wait_for(done, 'get_bugs')
+        self.assertEqual(got[0], (True, ['Bug 1']))
+        self.assertEqual(got[1], (True, ['Bug 2']))
+        self.failIf(got[2][0])
+        self.failUnless(isinstance(got[2][1], plugin.BugNotFoundError))
+        self.assertEqual(got[3], (True, ['Bug 3']))
+
+    def testConcurrentLookupsShareFetches(self):
+        tracker = FakeTracker()
+        tracker.gate.clear()
+        lookups = [self.lookup(tracker, [1, 2]) for i in range(5)]
+        time.sleep(0.05)
+        tracker.gate.set()
+        for (done, got) in lookups:
+            wait_for(done, 'get_bugs')
+            self.assertEqual(got, [(True, ['Bug 1']), (True, ['Bug 2'])])
+        self.assertEqual(sorted(tracker.calls), [1, 2])
+        self.assertEqual(self.bot.cache.coalesced, 8)
+
+    def testCachedLookupIsSynchronous(self):
+        tracker = FakeTracker()
+        wait_for(self.lookup(tracker, [7])[0], 'get_bugs')
+        (done, got) = self.lookup(tracker, [7])
+        self.failUnless(done.isSet())
+        self.assertEqual(tracker.calls, [7])
+
+class RepeatGuardTestCase(unittest.TestCase):
+    def testRepeat(self):
+        guard = plugin.RepeatGuard()
+        self.failUnless(guard.check(('#a', 'lp', 1), 60))
+        self.failIf(guard.check(('#a', 'lp', 1), 60))
+        self.failUnless(guard.check(('#b', 'lp', 1), 60))
+
+    def testNoDelay(self):
+        guard = plugin.RepeatGuard()
+        self.failUnless(guard.check('key', 0))
+        self.failUnless(guard.check('key', 0))
+        self.assertEqual(len(guard), 0)
+
+    def testExpiry(self):
+        guard = plugin.RepeatGuard()
+        self.failUnless(guard.check('short', 0.05))
+        self.failUnless(guard.check('long', 60))
+        time.sleep(0.1)
+        self.failUnless(guard.check('short', 0.05))
+        self.failIf(guard.check('long', 60))
+
+    def testCap(self):
+        guard = plugin.RepeatGuard(3)
+        for (i, delay) in enumerate((10, 50, 20, 40, 30)):
+            guard.check(i, delay)
+        self.assertEqual(len(guard), 3)
+        # The ones closest to expiring were dropped
+        self.assertEqual(sorted(guard.expires.keys()), [1, 3, 4])
+        self.failUnless(len(guard.heap) <= 3)
+
+class TrackerIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = plugin.TrackerIndex()
+        self.trackers = {}
+        for (name, url) in (('launchpad', 'https://launchpad.net'),
+                            ('gnome', 'http://bugzilla.gnome.org'),
+                            ('apache', 'https://issues.example.org/bugzilla'),
+                            ('apache-ooo', 'https://issues.example.org/ooo/bugzilla'),
+                            ('local', 'http://localhost:8000/trac/ticket')):
+            self.trackers[name] = plugin.IBugtracker(name, url, name)
+            self.index.add(name, self.trackers[name])
+
+    def lookup(self, url):
+        tracker = self.index.lookup(url)
+        return tracker and tracker.name
+
+    def testExactHost(self):
+        self.assertEqual(self.lookup('http://bugzilla.gnome.org/show_bug.cgi?id=1'), 'gnome')
+
+    def testLongestPrefix(self):
+        self.assertEqual(self.lookup('https://issues.example.org/ooo/bugzilla/show_bug.cgi?id=1'), 'apache-ooo')
+        self.assertEqual(self.lookup('https://issues.example.org/bugzilla/show_bug.cgi?id=1'), 'apache')
+        self.assertEqual(self.lookup('https://issues.example.org/ooo/bugzilla'), 'apache-ooo')
+
+    def testParentDomain(self):
+        self.assertEqual(self.lookup('https://bugs.launchpad.net/ubuntu/+source/linux/+bug/1'), 'launchpad')
+        self.assertEqual(self.lookup('https://api.staging.launchpad.net/1.0/bugs/1'), 'launchpad')
+        self.assertEqual(self.lookup('https://notlaunchpad.net/bugs/1'), None)
+
+    def testPortAndCase(self):
+        self.assertEqual(self.lookup('http://LOCALHOST:8000/trac/ticket/5'), 'local')
+
+    def testUnknownAndRemoved(self):
+        self.assertEqual(self.lookup('http://example.com/show_bug.cgi?id=1'), None)
+        self.index.remove('gnome')
+        self.assertEqual(self.lookup('http://bugzilla.gnome.org/show_bug.cgi?id=1'), None)
+        self.index.remove('apache-ooo')
+        self.assertEqual(self.lookup('https://issues.example.org/ooo/bugzilla/show_bug.cgi?id=1'), 'apache')
+
+class MakeCleanTestCase(unittest.TestCase):
+    def testWholeWords(self):
+        self.assertEqual(plugin.makeClean('bug 1 "no SHIT  happens,\tshit shit" [High,New]'),
+                         'bug 1 "no <censored> happens, <censored> shit" [High,New]')
+
+    def testURLUnchanged(self):
+        line = ('bug 2 "cocktail menu" [Low,New] http://bugs.example.org/shit-list/bitch\'s/cock?q=fuck '
+                '- Assigned to nazi-hunter')
+        self.assertEqual(plugin.makeClean(line), line)
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def testCacheBytes(self):
+        pool = transport.ConnectionPool(cachesize=10, cachebytes=100)
+        for i in range(3):
+            pool._remember(('http://example.org/%d' % i, None), '"%d"' % i, None, 'x' * 40)
+        self.assertEqual(pool._validators(('http://example.org/0', None)), None)
+        self.assertEqual(pool.bytes, 80)
+        # Replacing a body counts its new size only
+        pool._remember(('http://example.org/1', None), '"1b"', None, 'y' * 10)
+        self.assertEqual(pool.bytes, 50)
+        self.assertEqual(pool._validators(('http://example.org/1', None)), ('"1b"', None, 'y' * 10))
+        # A body over the limit on its own isn't kept
+        pool._remember(('http://example.org/big', None), '"big"', None, 'z' * 101)
+        self.assertEqual((len(pool.validated), pool.bytes), (0, 0))
+        pool._remember(('http://example.org/1', None), '"1"', None, 'x' * 40)
+        pool.clear()
+        self.assertEqual(pool.bytes, 0)
+
+    def testCountersUnderLoad(self):
+        pool = transport.ConnectionPool()
+        def count():
+            for i in range(2000):
+                pool._count('requests')
+        threads = [threading.Thread(target=count) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(pool.requests, 16000)
+
+class ZillaParserTestCase(unittest.TestCase):
+    missing = '<bug error="NotFound"><bug_id>404</bug_id></bug>'
+
+    def document(self, ids):
+        return repeat_bugs(fixture('bugzilla.xml'), ids, self.missing).replace('@BASE@', 'http://bugzilla.example.org')
+
+    def testFields(self):
+        bugs = plugin.ZillaParser(2).parse(StringIO(self.document([1, 2]))).bugs
+        self.assertEqual([bug['bug_id'] for bug in bugs], [u'1', u'2'])
+        for field in plugin.ZillaParser.fields:
+            self.failUnless(field in bugs[0], field)
+
+    def testMissingBug(self):
+        bugs = plugin.ZillaParser(3).parse(StringIO(self.document([1, 404, 3]))).bugs
+        self.assertEqual(len(bugs), 3)
+        self.assertEqual(bugs[1]['error'], 'NotFound')
+
+    def testStopsEarly(self):
+        # A thousand comments after the fields, none of them should be read
+        template = fixture('bugzilla.xml')
+        comment = template[template.index('<long_desc'):template.index('</long_desc>') + len('</long_desc>')]
+        pos = template.index('</bug>')
+        template = template[:pos] + comment * 1000 + template[pos:]
+        fd = CountingFile(repeat_bugs(template, [1]))
+        parser = plugin.ZillaParser(1).parse(fd, 1024)
+        self.failUnless(parser.done)
+        self.failUnless(fd.closed)
+        self.failUnless(fd.nread < len(fd.fd.getvalue()) / 10, fd.nread)
+
+    def testUrlbase(self):
+        self.assertEqual(plugin.ZillaParser(0).parse(StringIO(self.document([1]))).urlbase, 'http://bugzilla.example.org/bugzilla/')
+
+    def testBugzillaGetBugs(self):
+        tracker = plugin.Bugzilla('bz', 'http://bugzilla.example.org', 'Example')
+        tracker.open_url = lambda url, headers=None: StringIO(self.document([1, 404, 3]))
+        results = tracker.get_bugs([1, 404, 3])
+        self.assertEqual(results[1][0][0], 1)
+        self.assertEqual(results[3][0][0], 3)
+        self.failUnless(isinstance(results[404], plugin.BugNotFoundError))
+
+class PageScraperTestCase(unittest.TestCase):
+    def testStr(self):
+        page = fixture('str.html').replace('@ID@', '9')
+        expected = {'package': u'CUPS-1.4-current', 'status': u'Resolved', 'severity': u'Moderate',
+                    'title': u'lpstat -t hangs when a remote queue is unreachable', 'assignee': u'Michael Sweet'}
+        for chunksize in (1, 13, 100, 8192):
+            self.assertEqual(plugin.PageScraper(plugin.Str.fields).parse(StringIO(page), chunksize), expected)
+
+    def testWikiFormsStopsEarly(self):
+        page = fixture('wikiforms.html').replace('@ID@', '3') + '<p>padding</p>' * 10000
+        fd = CountingFile(page)
+        found = plugin.PageScraper(plugin.WikiForms.fields).parse(fd, 1024)
+        self.assertEqual(found['title'], u'Firmware blob still shipped in the linux-libre package')
+        self.assertEqual(found['status'], u'open')
+        self.failUnless(fd.nread <= 2048, fd.nread)
+        self.failUnless(fd.closed)
+
+    def testOrdered(self):
+        page = ('<html>' + 'x' * 10000 + '<h2>[ 123 ] Crash &amp; burn</h2>' + 'y' * 5000 +
+                'Assigned to:<br>  bob\nPriority: 5 Status:<br> Open and resolution:<br>\n None</html>')
+        for chunksize in (3, 50, 8192):
+            found = plugin.PageScraper(plugin.Sourceforge.fields, ordered=True).parse(StringIO(page), chunksize)
+            self.assertEqual(found, {'title': u'Crash & burn', 'assignee': u'bob', 'priority': u'5',
+                                     'status': u'Open', 'resolution': u'None'})
+
+    def testByteBudget(self):
+        scraper = plugin.PageScraper(plugin.WikiForms.fields)
+        scraper.max_bytes = 65536
+        self.assertRaises(plugin.BugtrackerError, scraper.parse, StringIO('<html>' + '<' * 200000))
+
+    def testStripTags(self):
+        self.assertEqual(plugin.strip_tags('<b>bold</b> <a href="x">link</a>'), 'bold link')
+        self.assertEqual(plugin.strip_tags('a < b <i>c</i>'), 'a < b c')
+        started = time.time()
+        plugin.strip_tags('<a' * 100000)
+        self.failUnless(time.time() - started < 1)
+
+class SOAPDecoderTestCase(unittest.TestCase):
+    debbugs_keep = ('item', 'key', 'value', 'package', 'subject', 'severity', 'fixed_versions')
+
+    def debbugs(self, name, ids):
+        return repeat_bugs(fixture(name), ids)
+
+    def testDebbugs(self):
+        result = soap.Decoder(frozenset(self.debbugs_keep)).decode(self.debbugs('debbugs.xml', [1, 2]))
+        self.assertEqual([item['key'] for item in result['item']], [u'1', u'2'])
+        value = result['item'][0]['value']
+        self.assertEqual(value['package'], u'isc-dhcp-client')
+        self.assertEqual(value['fixed_versions'], [u'isc-dhcp/4.1.1-P1-17'])
+        # Everything not asked for is skipped
+        self.failIf('found_versions' in value or 'originator' in value)
+
+    def testSingleItemIsNotAList(self):
+        result = soap.Decoder(frozenset(self.debbugs_keep)).decode(self.debbugs('debbugs.xml', [5]))
+        self.assertEqual(result['item']['key'], u'5')
+
+    def testBase64(self):
+        result = soap.Decoder(frozenset(self.debbugs_keep)).decode(self.debbugs('debbugs-base64.xml', [1]))
+        self.assertEqual(result['item']['value']['subject'],
+                         u'isc-dhcp-client: dhclient mangles hostnames, reported by J\xe9r\xf4me M\xfcller')
+
+    def testMantis(self):
+        data = fixture('mantis.xml').replace('@ID@', '7')
+        result = soap.Decoder(frozenset(('project', 'name', 'summary', 'priority', 'resolution'))).decode(data)
+        self.assertEqual(result['project']['name'], u'mantisbt')
+        self.assertEqual(result['resolution']['name'], u'fixed')
+        self.failIf('notes' in result or 'description' in result)
+
+    def testFault(self):
+        data = ('<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+                '<SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode><faultstring>Issue #404 not found.</faultstring>'
+                '<detail><x>y</x></detail></SOAP-ENV:Fault></SOAP-ENV:Body></SOAP-ENV:Envelope>')
+        try:
+            soap.Decoder(frozenset()).decode(data)
+        except soap.Fault, e:
+            self.assertEqual(e.code, u'SOAP-ENV:Client')
+            self.assertEqual(e.string, u'Issue #404 not found.')
+        else:
+            self.fail("No fault raised")
+
+    def testNil(self):
+        data = ('<E:Envelope xmlns:E="e" xmlns:xsi="x"><E:Body><r><return><a xsi:nil="true"/><b></b></return></r></E:Body></E:Envelope>')
+        self.assertEqual(soap.Decoder(frozenset(('a', 'b'))).decode(data), {'a': None, 'b': u''})
+
+    def testMethodCall(self):
+        sent = []
+        def send(url, body, headers):
+            sent.append((url, body, headers))
+            return self.debbugs('debbugs.xml', [1, 2])
+        method = soap.Method('http://debbugs.example.org/cgi-bin/soap.cgi', 'Debbugs/SOAP/Status', 'get_status',
+                             ('bugs',), self.debbugs_keep)
+        result = method.call(send, [1, 2])
+        self.assertEqual(len(result['item']), 2)
+        (url, body, headers) = sent[0]
+        self.failUnless('<bugs SOAP-ENC:arrayType="xsd:int[2]"' in body)
+        self.assertEqual(headers['SOAPAction'], '"Debbugs/SOAP/Status#get_status"')
+
+class CVEIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = cveindex.CVEIndex(os.path.join(self.dir, 'cve.idx'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def testEmpty(self):
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.lookup('CVE-2011-0997'), None)
+
+    def testLookupAndMerge(self):
+        self.assertEqual(self.index.update([('CVE-2011-0997', u'dhclient  does not sanitize'),
+                                            ('CVE-2014-0160', u'Heartbleed'),
+                                            ('not a cve', u'ignored')]), 2)
+        self.assertEqual(self.index.lookup('cve-2011-0997'), u'dhclient does not sanitize')
+        self.assertEqual(self.index.update([('CVE-2014-0160', u'Heartbleed, the OpenSSL one'),
+                                            ('CVE-2021-44228', u'Log4Shell – JNDI')]), 2)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.lookup('CVE-2014-0160'), u'Heartbleed, the OpenSSL one')
+        self.assertEqual(self.index.lookup('CVE-2021-44228'), u'Log4Shell – JNDI')
+        self.assertEqual(self.index.lookup('CVE-2011-0997'), u'dhclient does not sanitize')
+        self.assertEqual(self.index.lookup('CVE-2012-0001'), None)
+        self.assertEqual(self.index.lookup('bogus'), None)
+
+    def testReopen(self):
+        self.index.update([('CVE-2011-0997', u'dhclient')])
+        other = cveindex.CVEIndex(self.index.path)
+        try:
+            self.assertEqual(other.lookup('CVE-2011-0997'), u'dhclient')
+        finally:
+            other.close()
+
+    def testLookupDuringUpdate(self):
+        self.index.update([('CVE-2011-0997', u'dhclient')])
+        merging = threading.Event()
+        release = threading.Event()
+        existing = self.index._existing
+        def slow_existing():
+            merging.set()
+            release.wait(5)
+            return existing()
+        self.index._existing = slow_existing
+        updater = threading.Thread(target=self.index.update, args=([('CVE-2014-0160', u'Heartbleed')],))
+        updater.start()
+        try:
+            wait_for(merging, 'the merge')
+            # The merge doesn't hold up lookups
+            started = time.time()
+            self.assertEqual(self.index.lookup('CVE-2011-0997'), u'dhclient')
+            self.failUnless(time.time() - started < 1)
+        finally:
+            release.set()
+            updater.join(5)
+        self.assertEqual(self.index.lookup('CVE-2014-0160'), u'Heartbleed')
+
+    def dump(self, name, data):
+        path = os.path.join(self.dir, name)
+        fd = open(path, 'wb')
+        fd.write(data)
+        fd.close()
+        return list(cveindex.read_dump(path))
+
+    def testReadDump(self):
+        old = cveindex.chunksize
+        cveindex.chunksize = 7 # Records span many reads
+        try:
+            nvd = ('{"CVE_data_type": "CVE", "CVE_Items": [{"cve": {"CVE_data_meta": {"ID": "CVE-2011-0997"}, '
+                   '"description": {"description_data": [{"lang": "en", "value": "dhclient \\u2013 hostnames"}]}}}, '
+                   '{"cve": {"CVE_data_meta": {"ID": "CVE-2014-0160"}, '
+                   '"description": {"description_data": [{"lang": "en", "value": "Heartbleed [TLS]"}]}}}]}')
+            self.assertEqual(self.dump('nvd.json', nvd), [('CVE-2011-0997', u'dhclient \u2013 hostnames'),
+                                                          ('CVE-2014-0160', u'Heartbleed [TLS]')])
+            record = ('{"cveMetadata": {"cveId": "CVE-2021-44228"}, '
+                      '"containers": {"cna": {"descriptions": [{"lang": "en", "value": "Log4Shell"}]}}}')
+            self.assertEqual(self.dump('records.json', '\n[%s, %s]\n' % (record, record)),
+                             [('CVE-2021-44228', u'Log4Shell')] * 2)
+            self.assertEqual(self.dump('record.json', record), [('CVE-2021-44228', u'Log4Shell')])
+            self.assertEqual(self.dump('allitems.csv', 'CVE-2011-0997,Entry,dhclient\n'), [('CVE-2011-0997', u'dhclient')])
+            self.assertRaises(ValueError, self.dump, 'broken.json', nvd[:-20])
+        finally:
+            cveindex.chunksize = old
+
+class DuplicateMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'duplicates.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPersistence(self):
+        duplicates = plugin.DuplicateMap()
+        duplicates.load(self.path, 3600)
+        duplicates.set('https://api.launchpad.net/1.0', 1, 3)
+        duplicates.save()
+        duplicates = plugin.DuplicateMap()
+        duplicates.load(self.path, 3600)
+        self.assertEqual(duplicates.get('https://api.launchpad.net/1.0', 1), 3)
+        duplicates.forget('https://api.launchpad.net/1.0', 1)
+        self.assertEqual(duplicates.get('https://api.launchpad.net/1.0', 1), None)
+
+    def testExpiry(self):
+        duplicates = plugin.DuplicateMap()
+        duplicates.load(self.path, 0.05)
+        duplicates.set('root', 1, 3)
+        self.assertEqual(duplicates.get('root', 1), 3)
+        time.sleep(0.1)
+        self.assertEqual(duplicates.get('root', 1), None)
+
+class ChooseTaskTestCase(unittest.TestCase):
+    def testRanking(self):
+        lp = plugin.Launchpad('lp', 'https://launchpad.net', 'Launchpad')
+        tasks = [plugin.LPEntry(status=s, importance=i, n=n) for (n, (s, i)) in
+                 enumerate([('New', 'Low'), ('Triaged', 'High'), ('Triaged', 'Medium'), ('Fix Released', 'Critical')])]
+        self.assertEqual(lp._choose_task(iter(tasks)).n, 1)
+        self.assertEqual(lp._choose_task(tasks + [plugin.LPEntry(status='Brand New Status', importance='Low', n=9)]).n, 9)
+        self.assertEqual(lp._choose_task([]), None)
+
+class LaunchpadJSONTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lp = plugin.Launchpad('lpjson', 'https://launchpad.example.org', 'Launchpad')
+        self.lp.get_url = self.get_url
+        self.missing = ()
+
+    def get_url(self, url, headers=None):
+        """The web service, from the recorded responses"""
+        path = url[len(self.lp.api_root):].split('?')[0]
+        if path == '/bugs/5':
+            bug = fixture('launchpad-bug.json').replace('@ID@', '5').replace('@API@', self.lp.api_root)
+            bug = json.loads(bug)
+            for field in self.missing:
+                del bug[field]
+            return json.dumps(bug)
+        if path == '/bugs/5/bug_tasks':
+            return fixture('launchpad-tasks.json').replace('@ID@', '5').replace('@API@', self.lp.api_root)
+        if path.startswith('/~'):
+            return fixture('launchpad-person.json')
+        raise plugin.utils.web.Error("HTTP Error 404: Not Found")
+
+    def testBug(self):
+        before = plugin.stats.get('bugtracker_launchpad_requests_total', tracker='lpjson')
+        report = self.lp.get_bug_json(5)[0]
+        self.assertEqual(report[3:5], (u'Medium', u'Confirmed'))
+        self.assertEqual(report[7], '(affected: 27, heat: 142)')
+        # The bug and one page of tasks, the chosen task has no assignee
+        self.assertEqual(plugin.stats.get('bugtracker_launchpad_requests_total', tracker='lpjson') - before, 2)
+
+    def testMissingCounts(self):
+        self.missing = ('users_affected_count_with_dupes', 'heat')
+        self.assertEqual(self.lp.get_bug_json(5)[0][7], '(affected: 0, heat: 0)')
+
+    def testPrivateOrMissing(self):
+        try:
+            self.lp.get_bug_json(6)
+        except plugin.BugtrackerError, e:
+            self.failUnless("is private or doesn't exist" in str(e), str(e))
+        else:
+            self.fail("No error raised")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,333 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2008-2011 Terence Simpson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""
+HTTP transport shared by all bugtrackers: keep-alive connections pooled per
+host, gzip compressed responses and conditional GETs for bodies we have seen
+before, so an unchanged bug costs a 304 on an open connection.
+"""
+
+import httplib, socket, threading, time, zlib, urlparse
+from collections import OrderedDict
+from cStringIO import StringIO
+import supybot.utils as utils
+
+class HTTPError(utils.web.Error):
+    """A response with an error status, the status is kept in .status, the
+    (decompressed) body in .body and the url that returned it in .url"""
+    def __init__(self, status, reason, body='', url=None):
+        utils.web.Error.__init__(self, "HTTP Error %d: %s" % (status, reason))
+        self.status = status
+        self.body   = body
+        self.url    = url
+
+class Response:
+    """File-like body of a response, gunzipped while it's read. The connection
+    goes back to the pool once the body has been read to the end. Parsers
+    that stop early close the body, the rest is then still read if it's no
+    more than pool.maxdrain bytes, otherwise the connection is thrown away."""
+    def __init__(self, pool, key, conn, response, on_complete=None):
+        self.pool        = pool
+        self.key         = key
+        self.conn        = conn
+        self.response    = response
+        self.on_complete = on_complete # Called with the whole body, if it was all read
+        self.status      = response.status
+        self.headers     = dict(response.getheaders())
+        self.nbytes      = 0 # Bytes received, before decompression
+        self.body        = []
+        self.kept        = 0
+        self.done        = False
+        if response.getheader('content-encoding', '').lower() == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = None
+
+    def read(self, size=-1):
+        if self.done:
+            return ''
+        while True:
+            if size is None or size < 0:
+                data = self.response.read()
+            else:
+                data = self.response.read(size)
+            self.nbytes += len(data)
+            if not data:
+                if self.decompressor:
+                    data = self.decompressor.flush()
+                    self._keep(data)
+                self._finish()
+                return data
+            if self.decompressor:
+                data = self.decompressor.decompress(data)
+            if data: # A small gzipped chunk may not decompress to anything yet
+                break
+        self._keep(data)
+        if size is None or size < 0:
+            self._finish()
+        return data
+
+    def _keep(self, data):
+        if self.on_complete is None or not data:
+            return
+        if self.pool.maxbody and self.kept + len(data) > self.pool.maxbody:
+            self.on_complete = None # Too big to remember
+            self.body = []
+        else:
+            self.body.append(data)
+            self.kept += len(data)
+
+    def _finish(self):
+        self.done = True
+        self.pool._received(self.key, self.nbytes)
+        if self.response.will_close:
+            self.conn.close()
+        else:
+            self.pool._release(self.key, self.conn)
+        self.conn = None
+        if self.on_complete is not None:
+            self.on_complete(''.join(self.body))
+        self.body = []
+
+    def close(self):
+        if self.done:
+            return
+        remaining = self.response.length # None if the length isn't known
+        if remaining is None or remaining <= self.pool.maxdrain:
+            # Cheaper than a new connection, and the validators get stored
+            limit = self.nbytes + self.pool.maxdrain
+            try:
+                while self.read(16384):
+                    if self.nbytes > limit:
+                        break
+                if self.done:
+                    return
+            except (httplib.HTTPException, socket.error, zlib.error):
+                if self.done:
+                    return
+        self.abort()
+
+    def abort(self):
+        """Throw the connection away without reading the rest of the body"""
+        if not self.done:
+            self.done = True
+            self.pool._received(self.key, self.nbytes)
+            self.conn.close()
+            self.conn = None
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, pooled by (scheme, host), plus the
+    validators (ETag/Last-Modified) and bodies of recent GETs"""
+    max_redirects = 5
+
+    def __init__(self, timeout=10, maxidle=4, idletime=60, cachesize=500, cachebytes=8388608, maxbody=262144,
+                 maxdrain=65536):
+        self.timeout   = timeout   # Default socket timeout
+        self.maxidle   = maxidle   # Idle connections to keep per host
+        self.idletime  = idletime  # Seconds an idle connection is kept around
+        self.cachesize = cachesize # Number of bodies to keep for conditional GETs
+        self.cachebytes = cachebytes # Total size of the bodies kept, 0 means no limit
+        self.maxbody   = maxbody   # Don't keep bodies larger than this
+        self.maxdrain  = maxdrain  # Read up to this much of a closed body to keep its connection
+        self.idle      = {}        # (scheme, host) -> [(released at, connection)]
+        self.validated = OrderedDict() # (url, accept) -> (etag, last-modified, body)
+        self.bytes     = 0         # Total size of the bodies in validated
+        self.received  = {}        # host -> bytes received
+        self.lock      = threading.Lock()
+        self.requests = self.connections = self.revalidated = 0
+
+    def configure(self, **kwargs):
+        for (k, v) in kwargs.items():
+            setattr(self, k, v)
+
+    def _acquire(self, key, timeout):
+        """Returns (connection, reused)"""
+        now = time.time()
+        self.lock.acquire()
+        try:
+            idle = self.idle.get(key, [])
+            while idle:
+                (released, conn) = idle.pop()
+                if released + self.idletime > now and conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                    return (conn, True)
+                conn.close()
+            self.connections += 1
+        finally:
+            self.lock.release()
+        (scheme, host) = key
+        if scheme == 'https':
+            return (httplib.HTTPSConnection(host, timeout=timeout), False)
+        return (httplib.HTTPConnection(host, timeout=timeout), False)
+
+    def _release(self, key, conn):
+        self.lock.acquire()
+        try:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maxidle:
+                idle.append((time.time(), conn))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def _received(self, key, nbytes):
+        self.lock.acquire()
+        try:
+            self.received[key[1]] = self.received.get(key[1], 0) + nbytes
+        finally:
+            self.lock.release()
+
+    def _count(self, counter):
+        """Add one to a counter, pool threads update them concurrently"""
+        self.lock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self.lock.release()
+
+    def _remember(self, key, etag, modified, body):
+        self.lock.acquire()
+        try:
+            old = self.validated.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[2])
+            self.validated[key] = (etag, modified, body)
+            self.bytes += len(body)
+            while self.validated and (len(self.validated) > self.cachesize or
+                                      (self.cachebytes and self.bytes > self.cachebytes)):
+                (k, old) = self.validated.popitem(last=False)
+                self.bytes -= len(old[2])
+        finally:
+            self.lock.release()
+
+    def _validators(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.validated.pop(key, None)
+            if entry is not None:
+                self.validated[key] = entry
+            return entry
+        finally:
+            self.lock.release()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Send a request and return its Response. Redirects are followed,
+        and anything but a 2xx or 304 raises HTTPError"""
+        if timeout is None:
+            timeout = self.timeout
+        for i in range(self.max_redirects + 1):
+            (scheme, host, path, query, fragment) = urlparse.urlsplit(url)
+            if scheme not in ('http', 'https'):
+                raise utils.web.Error, "Unsupported URL: %s" % url
+            if query:
+                path = "%s?%s" % (path, query)
+            hdrs = dict(getattr(utils.web, 'defaultHeaders', {}))
+            hdrs['Accept-Encoding'] = 'gzip'
+            if headers:
+                hdrs.update(headers)
+            key = (scheme, host)
+            (conn, reused) = self._acquire(key, timeout)
+            try:
+                try:
+                    conn.request(method, path or '/', body, hdrs)
+                    response = conn.getresponse()
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # The server dropped a kept-alive connection, try a new one
+                    (conn, reused) = self._acquire(key, timeout)
+                    conn.request(method, path or '/', body, hdrs)
+                    response = conn.getresponse()
+            except socket.timeout, e:
+                conn.close()
+                raise utils.web.Error, "Connection to %s timed out" % host
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                raise utils.web.Error, "Connection to %s failed: %s" % (host, e)
+            self._count('requests')
+            if response.status in (301, 302, 303, 307) and response.getheader('location'):
+                response.read()
+                self._release(key, conn)
+                url = urlparse.urljoin(url, response.getheader('location'))
+                if response.status == 303:
+                    (method, body) = ('GET', None)
+                continue
+            if response.status != 304 and not (200 <= response.status < 300):
+                error = Response(self, key, conn, response)
+                raise HTTPError(response.status, response.reason, error.read(), url)
+            return Response(self, key, conn, response)
+        raise utils.web.Error, "Too many redirects for %s" % url
+
+    def open(self, url, headers=None, timeout=None):
+        """GET url, revalidating a previously seen body. Returns a file-like
+        object with the (decompressed) body"""
+        headers = dict(headers or {})
+        key = (url, headers.get('Accept'))
+        validators = self._validators(key)
+        if validators:
+            (etag, modified, body) = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
+        response = self.request('GET', url, headers=headers, timeout=timeout)
+        if response.status == 304 and validators:
+            response.read()
+            self._count('revalidated')
+            return StringIO(validators[2])
+        etag = response.headers.get('etag')
+        modified = response.headers.get('last-modified')
+        if etag or modified:
+            response.on_complete = lambda body: self._remember(key, etag, modified, body)
+        return response
+
+    def get(self, url, headers=None, timeout=None):
+        """GET url and return the whole body"""
+        fd = self.open(url, headers, timeout)
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def post(self, url, body, headers=None, timeout=None):
+        """POST body to url and return the whole response body"""
+        fd = self.request('POST', url, body, headers, timeout)
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            for idle in self.idle.values():
+                for (released, conn) in idle:
+                    conn.close()
+            self.idle = {}
+            self.validated.clear()
+            self.bytes = 0
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        idle = sum(map(len, self.idle.values()))
+        return ("%d requests, %d bytes received, %d new connections, %d idle connections, %d revalidated (304), "
+                "%d cached bodies (%d bytes)" % (self.requests, sum(self.received.values()), self.connections, idle,
+                                                 self.revalidated, len(self.validated), self.bytes))
+
+# The pool all bugtrackers share, see Bugtracker.__init__ for its configuration
+pool = ConnectionPool()